@@ -0,0 +1 @@
+"""Offline benchmarks of hikka_filters: ``python -m benchmarks --help``"""
@@ -0,0 +1,306 @@
+import asyncio
+import random
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import List, Optional
+
+from hikkatl.errors import FloodWaitError
+from hikkatl.tl.custom import Message
+from hikkatl.tl.types import (
+    Channel,
+    Chat,
+    ChatPhotoEmpty,
+    Document,
+    DocumentAttributeAnimated,
+    DocumentAttributeAudio,
+    DocumentAttributeSticker,
+    DocumentAttributeVideo,
+    InputPeerChannel,
+    InputStickerSetEmpty,
+    MessageFwdHeader,
+    MessageMediaDice,
+    MessageMediaDocument,
+    MessageMediaPhoto,
+    MessageReplyHeader,
+    PeerChannel,
+    PeerChat,
+    PeerUser,
+    Photo,
+    PhotoSize,
+    User,
+)
+
+DATE = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+ME_ID = 1000
+FIRST_USER_ID = 1001
+FIRST_CHANNEL_ID = 2001
+FIRST_CHAT_ID = 3001
+BOT_ID = 4001
+
+WORDS = ["hello", "world", "ping", "deploy", "status", "help", "weather", "music", "note", "todo"]
+
+
+class StubClient:
+    """
+    Offline stand-in of ``hikkatl.TelegramClient`` with simulated request latency
+
+    Implements only what the filters use: ``get_permissions``, ``get_fulluser``,
+    ``get_participants``, ``get_entity`` (by username) and ``get_messages`` (``msg.get_reply_message()``).
+    Every request sleeps ``latency`` seconds and is counted in ``calls``,
+    every ``flood_every``-th one raises ``FloodWaitError`` of ``flood_seconds``.
+    """
+    parse_mode = None
+
+    def __init__(
+        self,
+        users: List[User],
+        admins: frozenset = frozenset(),
+        chats: List[Channel] = (),
+        latency: float = 0.002,
+        flood_every: int = 0,
+        flood_seconds: int = 1,
+    ):
+        self.users = {user.id: user for user in users}
+        self.usernames = {entity.username.lower(): entity for entity in [*users, *chats] if entity.username}
+        self.admins = admins
+        self.latency = latency
+        self.flood_every = flood_every
+        self.flood_seconds = flood_seconds
+        self.calls = {"get_permissions": 0, "get_fulluser": 0, "get_participants": 0, "get_messages": 0, "get_entity": 0}
+
+    async def _request(self, method: str):
+        self.calls[method] += 1
+        await asyncio.sleep(self.latency)
+        if self.flood_every and sum(self.calls.values()) % self.flood_every == 0:
+            raise FloodWaitError(request=None, capture=self.flood_seconds)
+
+    async def get_permissions(self, entity, user):
+        await self._request("get_permissions")
+        return SimpleNamespace(is_admin=user in self.admins)
+
+    async def get_fulluser(self, user_id: int):
+        await self._request("get_fulluser")
+        return SimpleNamespace(full_user=SimpleNamespace(about="bio" if user_id % 3 == 0 else None))
+
+    async def get_participants(self, entity, filter=None):
+        await self._request("get_participants")
+        return [self.users[user_id] for user_id in self.admins if user_id in self.users]
+
+    async def get_entity(self, entity):
+        await self._request("get_entity")
+        if (found := self.usernames.get(str(entity).lstrip("@").lower())) is None:
+            raise ValueError(f'No user has "{entity}" as username')
+
+        return found
+
+    async def get_messages(self, entity, ids=None):
+        await self._request("get_messages")
+        # every 4th replied-to message is deleted
+        message_id = getattr(ids, "id", ids)
+        return None if message_id % 4 == 0 else make_message(id=message_id, message="replied")
+
+
+def make_user(user_id: int, rng: random.Random) -> User:
+    return User(
+        id=user_id,
+        is_self=user_id == ME_ID,
+        bot=rng.random() < 0.1,
+        premium=rng.random() < 0.2,
+        username=f"user{user_id}" if rng.random() < 0.7 else None,
+        first_name=f"User {user_id}",
+        access_hash=user_id,
+    )
+
+
+def make_channel(channel_id: int, broadcast: bool) -> Channel:
+    return Channel(
+        id=channel_id,
+        title=f"Channel {channel_id}",
+        photo=ChatPhotoEmpty(),
+        date=DATE,
+        broadcast=broadcast,
+        megagroup=not broadcast,
+        username=f"channel{channel_id}",
+        access_hash=channel_id,
+    )
+
+
+def make_chat(chat_id: int) -> Chat:
+    return Chat(
+        id=chat_id,
+        title=f"Chat {chat_id}",
+        photo=ChatPhotoEmpty(),
+        participants_count=10,
+        date=DATE,
+        version=1,
+    )
+
+
+def _document(attributes: list, mime_type: str) -> MessageMediaDocument:
+    return MessageMediaDocument(
+        document=Document(
+            id=1,
+            access_hash=1,
+            file_reference=b"",
+            date=DATE,
+            mime_type=mime_type,
+            size=1024,
+            dc_id=2,
+            attributes=attributes,
+        )
+    )
+
+
+def make_media(kind: Optional[str]):
+    """Media of a content type: ``photo``, ``video``, ``audio``, ``sticker``, ``animation``, ``document``, ``dice``"""
+    if kind is None:
+        return None
+
+    if kind == "photo":
+        return MessageMediaPhoto(
+            photo=Photo(
+                id=1,
+                access_hash=1,
+                file_reference=b"",
+                date=DATE,
+                sizes=[PhotoSize(type="m", w=320, h=320, size=1024)],
+                dc_id=2,
+            )
+        )
+
+    if kind == "video":
+        return _document([DocumentAttributeVideo(duration=1.0, w=320, h=320)], "video/mp4")
+
+    if kind == "audio":
+        return _document([DocumentAttributeAudio(duration=1)], "audio/mpeg")
+
+    if kind == "sticker":
+        return _document([DocumentAttributeSticker(alt="", stickerset=InputStickerSetEmpty())], "image/webp")
+
+    if kind == "animation":
+        return _document(
+            [DocumentAttributeVideo(duration=1.0, w=320, h=320), DocumentAttributeAnimated()],
+            "video/mp4",
+        )
+
+    if kind == "document":
+        return _document([], "application/pdf")
+
+    if kind == "dice":
+        return MessageMediaDice(value=6, emoticon="🎲")
+
+    raise ValueError(f"Unknown media kind: {kind}")
+
+
+def make_message(
+    id: int = 1,
+    message: str = "",
+    peer=None,
+    sender: Optional[User] = None,
+    chat=None,
+    post: bool = False,
+    out: bool = False,
+    media: Optional[str] = None,
+    forwarded: bool = False,
+    via_bot: bool = False,
+    reply_to: Optional[int] = None,
+    client: Optional[StubClient] = None,
+) -> Message:
+    """
+    A ``hikkatl`` message as it comes from updates: raw fields, the sender and chat entities and the client
+    """
+    peer = peer if peer is not None else PeerUser(sender.id if sender is not None else ME_ID)
+    from_id = PeerUser(sender.id) if sender is not None and not post else None
+    msg = Message(
+        id=id,
+        peer_id=peer,
+        date=DATE,
+        message=message,
+        out=out,
+        post=post,
+        from_id=from_id,
+        fwd_from=MessageFwdHeader(date=DATE, from_name="someone") if forwarded else None,
+        via_bot_id=BOT_ID if via_bot else None,
+        reply_to=MessageReplyHeader(reply_to_msg_id=reply_to) if reply_to is not None else None,
+        media=make_media(media),
+    )
+    msg._sender = chat if post else sender
+    msg._chat = chat if chat is not None else sender
+    if isinstance(peer, PeerChannel):
+        msg._input_chat = InputPeerChannel(channel_id=peer.channel_id, access_hash=peer.channel_id)
+
+    msg._client = client
+    return msg
+
+
+class MessageFactory:
+    """
+    Deterministic pools of realistic messages
+
+    Private chats, basic groups, supergroups and broadcast channels, senders with random
+    premium/bot/username flags, media of every content type, forwards, replies and commands.
+    """
+    MEDIA = [None] * 6 + ["photo", "video", "audio", "sticker", "animation", "document", "dice"]
+
+    def __init__(self, seed: int = 0, users: int = 200, channels: int = 20, chats: int = 10, latency: float = 0.002):
+        self.seed = seed
+        rng = random.Random(seed)
+        self.users = [make_user(user_id, rng) for user_id in range(FIRST_USER_ID, FIRST_USER_ID + users)]
+        self.users.append(make_user(ME_ID, rng))
+        self.supergroups = [make_channel(FIRST_CHANNEL_ID + i, broadcast=False) for i in range(0, channels, 2)]
+        self.broadcasts = [make_channel(FIRST_CHANNEL_ID + i, broadcast=True) for i in range(1, channels, 2)]
+        self.chats = [make_chat(FIRST_CHAT_ID + i) for i in range(chats)]
+        admins = frozenset(user.id for user in rng.sample(self.users, max(1, users // 10)))
+        self.client = StubClient(self.users, admins=admins, chats=self.supergroups + self.broadcasts, latency=latency)
+
+    def _text(self, rng: random.Random) -> str:
+        roll = rng.random()
+        if roll < 0.2:
+            return "." + rng.choice(WORDS) + (" " + " ".join(rng.choices(WORDS, k=rng.randint(1, 4))) if rng.random() < 0.6 else "")
+
+        if roll < 0.3:
+            return ""
+
+        return " ".join(rng.choices(WORDS, k=rng.randint(1, 12)))
+
+    def pool(self, size: int, round: int = 0) -> List[Message]:
+        """``size`` new messages (new objects on every call: results are not memoized across pools)"""
+        rng = random.Random(f"{self.seed}:{round}")
+        messages = []
+        for message_id in range(1, size + 1):
+            sender = rng.choice(self.users)
+            kind = rng.random()
+            post = False
+            if kind < 0.3:
+                chat = sender
+                peer = PeerUser(sender.id)
+            elif kind < 0.45:
+                chat = rng.choice(self.chats)
+                peer = PeerChat(chat.id)
+            elif kind < 0.85:
+                chat = rng.choice(self.supergroups)
+                peer = PeerChannel(chat.id)
+            else:
+                chat = rng.choice(self.broadcasts)
+                peer = PeerChannel(chat.id)
+                post = True
+
+            messages.append(
+                make_message(
+                    id=message_id,
+                    message=self._text(rng),
+                    peer=peer,
+                    sender=sender,
+                    chat=chat,
+                    post=post,
+                    out=sender.id == ME_ID,
+                    media=rng.choice(self.MEDIA),
+                    forwarded=rng.random() < 0.1,
+                    via_bot=rng.random() < 0.05,
+                    reply_to=rng.randint(1, 10 ** 6) if rng.random() < 0.25 else None,
+                    client=self.client,
+                )
+            )
+
+        return messages
@@ -0,0 +1,260 @@
+import argparse
+import asyncio
+import json
+import platform
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional
+
+import hikka_filters
+from hikka_filters import filters as hf
+
+from .fakes import FIRST_CHANNEL_ID, FIRST_USER_ID, WORDS, MessageFactory
+
+PATTERNS = [f"{word}{i}" for i in range(50) for word in WORDS]  # 500 patterns
+
+
+def _deep(operator: Callable, leaves: List[hf.Filter], depth: int) -> hf.Filter:
+    flt = leaves[0]
+    for i in range(1, depth):
+        flt = operator(flt, leaves[i % len(leaves)])
+    return flt
+
+
+def cases() -> Dict[str, Callable[[], hf.Filter]]:
+    """Benchmark name -> filter factory (filters are built after the caches are cleared)"""
+    raw = [hf.reply_header, hf.via_bot, hf.media, hf.group_chat, hf.channel]
+    users = list(range(FIRST_USER_ID, FIRST_USER_ID + 50))
+    chats = list(range(FIRST_CHANNEL_ID, FIRST_CHANNEL_ID + 10))
+    return {
+        # built-in filters
+        **{
+            f"builtin.{name}": (lambda name=name: getattr(hf, name))
+            for name in [
+                "chat_admin",
+                "chat_admin_prefetched",
+                "premium_user",
+                "user_has_username",
+                "sender_bot",
+                "user_has_bio",
+                "me",
+                "reply",
+                "reply_header",
+                "group_chat",
+                "channel",
+                "args",
+                "via_bot",
+                "media",
+            ]
+        },
+        "builtin.user.ids": lambda: hf.user(users),
+        "builtin.user.usernames": lambda: hf.user([f"user{user_id}" for user_id in users]),
+        "builtin.chat.ids": lambda: hf.chat(chats),
+        "builtin.chat.usernames": lambda: hf.chat([f"channel{chat_id}" for chat_id in chats]),
+        # text()
+        "text.exact": lambda: hf.text(PATTERNS),
+        "text.startswith.1": lambda: hf.text(startswith="."),
+        "text.startswith.500": lambda: hf.text(startswith=PATTERNS),
+        "text.endswith.500": lambda: hf.text(endswith=PATTERNS),
+        "text.re_match.10": lambda: hf.text(re_match=[rf"\.{word}\b" for word in WORDS]),
+        "text.re_search.500": lambda: hf.text(re_search=PATTERNS),
+        "text.re_search.500.process": lambda: hf.text(re_search=PATTERNS, cpu_bound=True),
+        # content_types / chat_type
+        "content_types.1": lambda: hf.content_types("photo"),
+        "content_types.all": lambda: hf.content_types(hf.CONTENT_TYPES),
+        "chat_type.1": lambda: hf.chat_type("private"),
+        "chat_type.all": lambda: hf.chat_type(hf.CHAT_TYPES),
+        # throttle in front of a network filter
+        "throttle.lru": lambda: hf.throttle(1, 2, maxkeys=1000) & hf.user_has_bio,
+        "throttle.sketch": lambda: hf.throttle(1, 2, maxkeys=1000, mode="sketch") & hf.user_has_bio,
+        # trees
+        "tree.and.32": lambda: _deep(hf.Filter.__and__, raw, 32),
+        "tree.or.32": lambda: _deep(hf.Filter.__or__, [~flt for flt in raw], 32),
+        "tree.mixed": lambda: (
+            (hf.chat_type(["supergroup", "group"]) & hf.text(startswith=PATTERNS) & ~hf.sender_bot)
+            | (hf.content_types(["photo", "video"]) & hf.premium_user)
+            | (hf.reply_header & hf.reply)
+        ),
+        "tree.network": lambda: hf.user_has_bio & hf.chat_admin & ~hf.via_bot & hf.group_chat,
+        "tree.command": lambda: hf.text(startswith=".") & hf.args & ~hf.sender_bot,
+    }
+
+
+def _percentile(sorted_values: List[float], q: float) -> float:
+    return sorted_values[min(len(sorted_values) - 1, int(q * len(sorted_values)))]
+
+
+def _reset():
+    hf.admin_cache.clear()
+    hf.full_user_cache.clear()
+    hf.admin_index.clear()
+    hf.username_index.clear()
+    hf.scheduler.clear()
+
+
+async def bench(name: str, factory: Callable[[], hf.Filter], messages: MessageFactory, size: int, rounds: int) -> dict:
+    """
+    Check ``rounds`` pools of ``size`` new messages one by one, as a watcher does
+
+    Caches are cleared before each round, so network filters pay their first requests.
+    """
+    latencies = []
+    passed = 0
+    total = 0.0
+    calls_before = dict(messages.client.calls)
+    for round in range(rounds):
+        _reset()
+        plan = hf.compile_filter(factory())
+        pool = messages.pool(size, round)
+        perf_counter = time.perf_counter
+        started = perf_counter()
+        for msg in pool:
+            start = perf_counter()
+            if await plan(msg):
+                passed += 1
+            latencies.append(perf_counter() - start)
+        total += perf_counter() - started
+
+    latencies.sort()
+    count = len(latencies)
+    return {
+        "messages": count,
+        "seconds": total,
+        "throughput": count / total if total else 0.0,
+        "mean_us": sum(latencies) / count * 1e6,
+        "p50_us": _percentile(latencies, 0.50) * 1e6,
+        "p99_us": _percentile(latencies, 0.99) * 1e6,
+        "max_us": latencies[-1] * 1e6,
+        "passed": passed / count,
+        "requests": {
+            method: calls - calls_before[method]
+            for method, calls in messages.client.calls.items()
+            if calls != calls_before[method]
+        },
+    }
+
+
+def _versions() -> dict:
+    try:
+        from importlib.metadata import version
+        hikkatl = version("Hikka-TL-New")
+    except Exception:
+        hikkatl = None
+
+    return {
+        "hikka_filters": hikka_filters.__version__,
+        "hikkatl": hikkatl,
+        "python": sys.version.split()[0],
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+    }
+
+
+async def run(
+    size: int = 2000,
+    rounds: int = 3,
+    latency: float = 0.002,
+    seed: int = 0,
+    only: Optional[str] = None,
+    rate: float = 1000.0,
+) -> dict:
+    messages = MessageFactory(seed=seed, latency=latency)
+    # the stub has no rate limits, the default ones would measure only the token bucket
+    hf.scheduler.configure(rate=rate, burst=int(rate))
+    results = {}
+    for name, factory in cases().items():
+        if only and only not in name:
+            continue
+
+        results[name] = await bench(name, factory, messages, size, rounds)
+        print(_format_row(name, results[name]), file=sys.stderr)
+
+    return {
+        "meta": {
+            "date": datetime.now(timezone.utc).isoformat(),
+            "messages": size,
+            "rounds": rounds,
+            "latency": latency,
+            "rate": rate,
+            "seed": seed,
+            **_versions(),
+        },
+        "results": results,
+    }
+
+
+def _format_row(name: str, result: dict) -> str:
+    return (
+        f"{name:<32} {result['throughput']:>12,.0f} msg/s"
+        f"  p50 {result['p50_us']:>9.1f} us  p99 {result['p99_us']:>9.1f} us"
+        f"  passed {result['passed']:>6.1%}"
+    )
+
+
+def compare(base: dict, new: dict, threshold: float = 0.1) -> List[str]:
+    """
+    Lines with throughput and p99 changes of ``new`` against ``base``;
+    changes larger than ``threshold`` are marked ``!``
+    """
+    lines = [f"{'benchmark':<32} {'throughput':>10} {'p50':>10} {'p99':>10}"]
+    for name, result in new["results"].items():
+        if name not in base["results"]:
+            lines.append(f"{name:<32} {'new':>10}")
+            continue
+
+        old = base["results"][name]
+        throughput = result["throughput"] / old["throughput"] - 1 if old["throughput"] else 0.0
+        p50 = result["p50_us"] / old["p50_us"] - 1 if old["p50_us"] else 0.0
+        p99 = result["p99_us"] / old["p99_us"] - 1 if old["p99_us"] else 0.0
+        mark = " !" if throughput < -threshold or p99 > threshold else ""
+        lines.append(f"{name:<32} {throughput:>+10.1%} {p50:>+10.1%} {p99:>+10.1%}{mark}")
+
+    for name in base["results"]:
+        if name not in new["results"]:
+            lines.append(f"{name:<32} {'removed':>10}")
+
+    return lines
+
+
+def main(argv: Optional[List[str]] = None):
+    parser = argparse.ArgumentParser(
+        prog="python -m benchmarks",
+        description="Offline benchmarks of hikka_filters on synthetic hikkatl messages",
+    )
+    parser.add_argument("-o", "--output", help="write results to this JSON file")
+    parser.add_argument("-n", "--messages", type=int, default=2000, help="messages per round (default: 2000)")
+    parser.add_argument("-r", "--rounds", type=int, default=3, help="rounds, each on new messages (default: 3)")
+    parser.add_argument("--latency", type=float, default=0.002, help="simulated request latency, seconds (default: 0.002)")
+    parser.add_argument("--rate", type=float, default=1000.0, help="scheduler rate limit, requests per second (default: 1000)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("-k", "--only", help="run only benchmarks with this substring in the name")
+    parser.add_argument(
+        "--compare",
+        nargs="+",
+        metavar="JSON",
+        help="compare runs: BASE [NEW] (without NEW - against a new run)",
+    )
+    options = parser.parse_args(argv)
+
+    if options.compare and len(options.compare) > 2:
+        parser.error("--compare takes one or two JSON files")
+
+    if options.compare and len(options.compare) == 2:
+        with open(options.compare[0]) as base, open(options.compare[1]) as new:
+            print("\n".join(compare(json.load(base), json.load(new))))
+        return
+
+    results = asyncio.run(
+        run(options.messages, options.rounds, options.latency, options.seed, options.only, options.rate)
+    )
+    if options.output:
+        with open(options.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if options.compare:
+        with open(options.compare[0]) as base:
+            print("\n".join(compare(json.load(base), results)))
+    elif not options.output:
+        print(json.dumps(results, indent=2))
@@ -1,5 +1,9 @@
 from .filters import *
 from .filters import __all__
+from .dispatcher import Router
+from .commands import CommandRegistry
+
+__all__ = [*__all__, "Router", "CommandRegistry"]
 
 
 __version__ = "0.2.0"
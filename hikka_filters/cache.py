@@ -0,0 +1,365 @@
+import asyncio
+import json
+import logging
+import os
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional
+
+from hikkatl.tl.types import ChannelParticipantsAdmins, PeerChannel, UpdateChannelParticipant
+
+from .scheduler import RequestDeferred, scheduler
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncTTLCache:
+    """
+    Bounded cache for results of Telegram API requests
+
+    Entries live ``ttl`` seconds, the least recently used ones are evicted above ``maxsize``.
+    Concurrent lookups of one key share a single in-flight request,
+    ``concurrency`` limits the number of requests in flight for different keys.
+    """
+    def __init__(self, ttl: float = 300, maxsize: int = 10000, concurrency: Optional[int] = None):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self.concurrency = concurrency
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._pending = {}  # key -> asyncio.Task
+        self._semaphore = None
+
+    def configure(self, ttl: Optional[float] = None, maxsize: Optional[int] = None):
+        """Change TTL (seconds) and/or max size of the cache"""
+        if ttl is not None:
+            self.ttl = ttl
+
+        if maxsize is not None:
+            self.maxsize = maxsize
+            self._evict()
+
+    def _evict(self):
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def set(self, key: Hashable, value: Any):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        self._evict()
+
+    def get_cached(self, key: Hashable, default: Any = None) -> Any:
+        """Get a fresh cached value without requesting it"""
+        if (entry := self._data.get(key)) is None:
+            return default
+
+        if entry[0] <= time.monotonic():
+            del self._data[key]
+            return default
+
+        self._data.move_to_end(key)
+        return entry[1]
+
+    async def get(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """Get a value by key, ``fetch()`` is awaited on miss (once for all concurrent lookups)"""
+        if (entry := self._data.get(key)) is not None:
+            if entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+
+            del self._data[key]
+
+        if (task := self._pending.get(key)) is None:
+            # a separate task, so cancelling the first caller does not fail the others
+            task = self._pending[key] = asyncio.ensure_future(self._fetch(key, fetch))
+            self.misses += 1
+        else:
+            self.coalesced += 1
+
+        return await asyncio.shield(task)
+
+    async def _fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            if self.concurrency is None:
+                value = await fetch()
+            else:
+                if self._semaphore is None:
+                    self._semaphore = asyncio.Semaphore(self.concurrency)
+
+                async with self._semaphore:
+                    value = await fetch()
+        finally:
+            self._pending.pop(key, None)
+
+        self.set(key, value)
+        return value
+
+    def stats(self) -> dict:
+        """Cache hits, misses (requests made), lookups joined to an in-flight request and size"""
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+        }
+
+    def invalidate(self, key: Hashable):
+        self._data.pop(key, None)
+
+    def invalidate_where(self, predicate: Callable[[Hashable], bool]):
+        """Drop all entries with keys matching ``predicate(key)``"""
+        for key in [key for key in self._data if predicate(key)]:
+            del self._data[key]
+
+    def clear(self):
+        self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+
+class AdminIndex:
+    """
+    Prefetched admins of supergroups
+
+    The admin list of a chat is fetched once (``ChannelParticipantsAdmins``) and kept as a set of IDs,
+    so admin checks need no request. A list older than ``refresh_interval`` seconds (or invalidated
+    by ``notify``/``invalidate``) is refreshed in the background, at most once per ``min_refresh_interval``.
+    A failed fetch (e.g. admin rights are required) is retried not earlier than ``min_refresh_interval``,
+    meanwhile the last known list (or no admins) is used.
+    """
+    def __init__(self, refresh_interval: float = 600, min_refresh_interval: float = 30, maxchats: int = 1000):
+        self.refresh_interval = refresh_interval
+        self.min_refresh_interval = min_refresh_interval
+        self.maxchats = maxchats
+        self._chats = OrderedDict()  # channel_id -> [fetched_at, stale, frozenset of admins IDs]
+        self._pending = {}  # channel_id -> asyncio.Task
+
+    async def is_admin(self, client, channel_id: int, user_id: int) -> bool:
+        if (entry := self._chats.get(channel_id)) is None:
+            return user_id in await asyncio.shield(self._refresh(client, channel_id))
+
+        self._chats.move_to_end(channel_id)
+        fetched_at, stale, admins = entry
+        age = time.monotonic() - fetched_at
+        if (age > self.refresh_interval or stale and age > self.min_refresh_interval) and channel_id not in self._pending:
+            self._refresh(client, channel_id)
+
+        return user_id in admins
+
+    def _refresh(self, client, channel_id: int) -> asyncio.Task:
+        if (task := self._pending.get(channel_id)) is None:
+            task = self._pending[channel_id] = asyncio.ensure_future(self._fetch(client, channel_id))
+            task.add_done_callback(self._log_error)
+
+        return task
+
+    async def _fetch(self, client, channel_id: int) -> frozenset:
+        try:
+            admins = frozenset(
+                user.id
+                for user in await scheduler.call(
+                    "get_participants",
+                    channel_id,
+                    lambda: client.get_participants(channel_id, filter=ChannelParticipantsAdmins()),
+                )
+            )
+        except RequestDeferred:
+            # answered by the scheduler fallback, without requests
+            raise
+        except Exception:
+            logger.debug("Can't fetch admins of the chat %s", channel_id, exc_info=True)
+            # stale: retried after ``min_refresh_interval``, not on every message of the chat
+            entry = self._chats.get(channel_id)
+            admins = entry[2] if entry is not None else frozenset()
+            self._store(channel_id, [time.monotonic(), True, admins])
+            return admins
+        finally:
+            self._pending.pop(channel_id, None)
+
+        self._store(channel_id, [time.monotonic(), False, admins])
+        return admins
+
+    def _store(self, channel_id: int, entry: list):
+        self._chats[channel_id] = entry
+        self._chats.move_to_end(channel_id)
+        while len(self._chats) > self.maxchats:
+            self._chats.popitem(last=False)
+
+    @staticmethod
+    def _log_error(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.debug("Can't fetch admins of the chat", exc_info=task.exception())
+
+    def get(self, channel_id: int) -> Optional[frozenset]:
+        """Known admins IDs of a chat (without requests)"""
+        return entry[2] if (entry := self._chats.get(channel_id)) is not None else None
+
+    def invalidate(self, channel_id: int):
+        """Mark the admin list of a chat as stale, it will be refreshed in the background on next check"""
+        if (entry := self._chats.get(channel_id)) is not None:
+            entry[1] = True
+
+    def notify(self, update):
+        """
+        Pass participant updates and service messages here (e.g. from a watcher),
+        admin lists of affected chats are refreshed
+        """
+        if isinstance(update, UpdateChannelParticipant):
+            self.invalidate(update.channel_id)
+        elif getattr(update, "action", None) is not None and isinstance(getattr(update, "peer_id", None), PeerChannel):
+            self.invalidate(update.peer_id.channel_id)
+
+    def clear(self):
+        self._chats.clear()
+
+    def __len__(self):
+        return len(self._chats)
+
+
+class UsernameIndex:
+    """
+    Usernames resolved to IDs (for ``user``/``chat`` filters, so they compare IDs only)
+
+    A username is resolved in the background after its first use (``client.get_entity``, through ``scheduler``),
+    then its ID is refreshed every ``refresh_interval`` seconds. Usernames which can't be resolved
+    are retried after ``retry_interval`` seconds. With ``path`` the mapping is saved as JSON and loaded
+    on start, so a restart makes no requests for known usernames.
+    """
+    def __init__(self, refresh_interval: float = 86400, retry_interval: float = 600, path: Optional[str] = None):
+        self.refresh_interval = refresh_interval
+        self.retry_interval = retry_interval
+        self.path = None
+        self.version = 0  # changed when any ID changes
+        self._usernames = {}  # username -> [ID or None, time.time() of the next refresh]
+        self._pending = {}  # username -> asyncio.Task
+        self._batches = set()  # tasks resolving new usernames
+        self._refresher = None
+        if path is not None:
+            self.load(path)
+
+    @staticmethod
+    def normalize(username: str) -> str:
+        return username.lstrip("@").lower()
+
+    def get(self, username: str) -> Optional[int]:
+        """ID of a resolved username (without requests)"""
+        return entry[0] if (entry := self._usernames.get(self.normalize(username))) is not None else None
+
+    def ids(self, usernames: Iterable[str]) -> Dict[str, Optional[int]]:
+        return {username: self.get(username) for username in usernames}
+
+    def resolve(self, client, usernames: Iterable[str]):
+        """Start resolving unknown usernames in the background (known ones are refreshed on schedule)"""
+        if unknown := [
+            username
+            for username in map(self.normalize, usernames)
+            if username not in self._usernames and username not in self._pending
+        ]:
+            self._batches.add(task := asyncio.ensure_future(self._resolve_batch(client, unknown)))
+            task.add_done_callback(self._batches.discard)
+            task.add_done_callback(self._log_error)
+
+        self._start_refresher(client)
+
+    def _start_refresher(self, client):
+        if self._usernames and (self._refresher is None or self._refresher.done()):
+            self._refresher = asyncio.ensure_future(self._refresh_loop(client))
+            self._refresher.add_done_callback(self._log_error)
+
+    async def _resolve_batch(self, client, usernames: list):
+        await asyncio.gather(*(self._resolve(client, username) for username in usernames))
+        self.save()
+        self._start_refresher(client)
+
+    def _resolve(self, client, username: str) -> asyncio.Task:
+        if (task := self._pending.get(username)) is None:
+            task = self._pending[username] = asyncio.ensure_future(self._fetch(client, username))
+
+        return task
+
+    async def _fetch(self, client, username: str):
+        retry = self.retry_interval
+        try:
+            entity = await scheduler.call("get_entity", username, lambda: client.get_entity(username))
+        except RequestDeferred as e:
+            peer_id, retry = None, e.seconds
+        except Exception:
+            # not occupied or invalid (``ValueError``, ``UsernameNotOccupiedError``...)
+            logger.debug("Can't resolve @%s", username, exc_info=True)
+            peer_id = None
+        else:
+            peer_id = entity.id
+        finally:
+            self._pending.pop(username, None)
+
+        if (entry := self._usernames.get(username)) is not None and entry[0] is not None and peer_id is None:
+            # keep the known ID until the username is resolved again
+            entry[1] = time.time() + retry
+            return
+
+        if entry is None or entry[0] != peer_id:
+            self.version += 1
+
+        self._usernames[username] = [peer_id, time.time() + (self.refresh_interval if peer_id is not None else retry)]
+
+    async def _refresh_loop(self, client):
+        while self._usernames:
+            due = min(entry[1] for entry in self._usernames.values())
+            await asyncio.sleep(max(due - time.time(), 1))
+            now = time.time()
+            if stale := [username for username, entry in self._usernames.items() if entry[1] <= now]:
+                await asyncio.gather(*(self._resolve(client, username) for username in stale))
+                self.save()
+
+    @staticmethod
+    def _log_error(task: asyncio.Task):
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning("Refreshing of usernames failed", exc_info=task.exception())
+
+    def load(self, path: str):
+        """Use ``path`` to keep the mapping, known usernames are loaded from it"""
+        self.path = path
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError):
+            logger.warning("Can't load usernames from %s", path, exc_info=True)
+            return
+
+        for username, (peer_id, refresh_at) in data.items():
+            self._usernames[self.normalize(username)] = [peer_id, refresh_at]
+
+        self.version += 1
+
+    def save(self):
+        if self.path is None:
+            return
+
+        try:
+            with open(tmp := f"{self.path}.tmp", "w", encoding="utf-8") as f:
+                json.dump(self._usernames, f)
+
+            os.replace(tmp, self.path)
+        except OSError:
+            logger.warning("Can't save usernames to %s", self.path, exc_info=True)
+
+    def stop(self):
+        """Stop refreshing in the background"""
+        if self._refresher is not None:
+            self._refresher.cancel()
+            self._refresher = None
+
+    def clear(self):
+        self.stop()
+        self._usernames.clear()
+        self.version += 1
+
+    def __len__(self):
+        return len(self._usernames)
@@ -0,0 +1,117 @@
+import logging
+from typing import Callable, Iterable, List, Optional
+
+from .filters import Filter, compile_filter
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+_HANDLERS = None  # key of the handlers in a trie node (other keys are characters)
+
+
+class CommandRegistry:
+    """
+    Commands of a module in one prefix trie (``prefix + name``, case-insensitive)
+
+    For commands dispatched by a watcher of the module, not by Hikka: handlers are registered
+    explicitly (not by ``command()``) and must not be named ``...cmd``. ``match`` finds the handlers
+    of a message in one pass over its first word, without splitting the text.
+    Handlers are kept by their qualified name, so a reloaded module replaces its old handlers.
+
+        commands = CommandRegistry(prefixes=(".", "!"))
+
+        @loader.tds
+        class MyModule(loader.Module):
+            @loader.watcher(only_messages=True)
+            async def watcher(self, message):
+                await commands.feed(self, message)
+
+            @commands.handler("ping", filters=args)
+            async def ping_handler(self, message):
+                ...
+    """
+    def __init__(self, prefixes: Iterable[str] = (".",)):
+        self.prefixes = tuple(prefixes)
+        self.handlers = {}  # name -> {qualified name: (handler, plan)}
+        self._root = {}
+
+    def _insert(self, key: str, handlers: dict):
+        node = self._root
+        for char in key:
+            node = node.setdefault(char, {})
+
+        node[_HANDLERS] = handlers
+
+    def _build(self):
+        self._root = {}
+        for prefix in self.prefixes:
+            for name, handlers in self.handlers.items():
+                self._insert(prefix + name, handlers)
+
+    def set_prefixes(self, prefixes: Iterable[str]):
+        self.prefixes = tuple(prefixes)
+        self._build()
+
+    def register(self, func: Callable, name: Optional[str] = None, filters: Optional[Filter] = None) -> Callable:
+        """Add a handler of command ``name`` (default: name of ``func``), checked with ``filters``"""
+        name = (name or func.__name__).lower()
+        if (handlers := self.handlers.get(name)) is None:
+            handlers = self.handlers[name] = {}
+            for prefix in self.prefixes:
+                self._insert(prefix + name, handlers)
+
+        handlers[getattr(func, "__qualname__", repr(func))] = (func, compile_filter(filters) if filters is not None else None)
+        return func
+
+    def handler(self, name: Optional[str] = None, filters: Optional[Filter] = None) -> Callable[[Callable], Callable]:
+        """Decorator for ``register``"""
+        return lambda func: self.register(func, name, filters)
+
+    def unregister(self, name: str, func: Optional[Callable] = None):
+        """Remove a handler (or all handlers) of a command"""
+        if (handlers := self.handlers.get(name := name.lower())) is None:
+            return
+
+        if func is not None:
+            handlers.pop(getattr(func, "__qualname__", repr(func)), None)
+
+        if func is None or not handlers:
+            del self.handlers[name]
+            self._build()
+
+    def match(self, text: Optional[str]) -> List[tuple]:
+        """``(handler, plan)`` of the command in ``text`` (``[]`` - not a command)"""
+        if not text:
+            return []
+
+        node = self._root
+        for char in text:
+            if char.isspace():
+                break
+
+            if (node := node.get(char) or node.get(char.lower())) is None:
+                return []
+
+        return list(handlers.values()) if (handlers := node.get(_HANDLERS)) else []
+
+    async def feed(self, _, message, *args, **kwargs) -> int:
+        """
+        Check the message and call the matched handlers of its command (``handler(_, message, *args, **kwargs)``).
+        Returns the number of called handlers.
+        """
+        called = 0
+        for func, plan in self.match(getattr(message, "raw_text", None) or getattr(message, "message", None)):
+            if plan is not None and not (
+                await metrics.measure(getattr(func, "__qualname__", str(func)), plan(message, *args, **kwargs))
+                if metrics.active
+                else await plan(message, *args, **kwargs)
+            ):
+                continue
+
+            called += 1
+            try:
+                await func(_, message, *args, **kwargs)
+            except Exception:
+                logger.exception("Command %s failed", getattr(func, "__name__", func))
+
+        return called
@@ -0,0 +1,62 @@
+import weakref
+from typing import Any, Callable
+
+_facets = {}  # name -> func(update)
+_contexts = {}  # id(update) -> EvaluationContext
+
+
+class EvaluationContext:
+    """
+    Facts about one update, shared by all filters checking it
+
+    A facet (see ``facet``) is computed on the first access (``get_context(update).name``)
+    and memoized until the update is garbage collected.
+    """
+    def __init__(self, update):
+        self._update = weakref.ref(update)
+
+    def __getattr__(self, name: str) -> Any:
+        if (func := _facets.get(name)) is None or (update := self._update()) is None:
+            raise AttributeError(name)
+
+        value = func(update)
+        setattr(self, name, value)
+        return value
+
+
+class _StrongContext(EvaluationContext):
+    """Context of an update without weakrefs support, lives only while used"""
+    def __init__(self, update):
+        self._update = lambda: update
+
+
+def get_context(update) -> EvaluationContext:
+    """Evaluation context of the update (one per update object)"""
+    if (ctx := _contexts.get(key := id(update))) is not None:
+        return ctx
+
+    try:
+        weakref.finalize(update, _contexts.pop, key, None)
+    except TypeError:
+        return _StrongContext(update)
+
+    ctx = _contexts[key] = EvaluationContext(update)
+    return ctx
+
+
+def facet(name: str) -> Callable[[Callable[[Any], Any]], Callable[[Any], Any]]:
+    """
+    Register a memoized fact about updates:
+
+        @facet("words")
+        def words(msg):
+            return (msg.raw_text or "").split()
+
+        async def many_words_filter(flt, msg):
+            return len(get_context(msg).words) > 10
+    """
+    def decorator(func):
+        _facets[name] = func
+        return func
+
+    return decorator
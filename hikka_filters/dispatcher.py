@@ -0,0 +1,155 @@
+import logging
+from typing import Callable, List, Optional
+
+from .context import get_context
+from .filters import _AND, _CONTENT_TYPE_BITS, _LEAF, _OR, Filter, _content_type_bits, _peer_id, compile_filter
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def _chat_keys(update) -> tuple:
+    return () if (chat_id := _peer_id(getattr(update, "peer_id", None))) is None else (chat_id,)
+
+
+def _sender_keys(update) -> tuple:
+    return () if (sender_id := getattr(update, "sender_id", None)) is None else (sender_id,)
+
+
+def _prefix_keys(update) -> tuple:
+    return (_text[0],) if (_text := get_context(update).text_lower) else ()
+
+
+def _chat_type_keys(update) -> tuple:
+    return () if (_type := get_context(update).chat_type) is None else (_type,)
+
+
+def _content_keys(update) -> list:
+    bits = _content_type_bits(update)
+    return [_type for _type, bit in _CONTENT_TYPE_BITS.items() if bits & bit]
+
+
+# dimensions, the most selective first: a handler is indexed by the first one its filters have
+DIMENSIONS = {
+    "chat": _chat_keys,
+    "sender": _sender_keys,
+    "prefix": _prefix_keys,
+    "chat_type": _chat_type_keys,
+    "content": _content_keys,
+}
+
+# dimensions where an update may have several keys at once
+MULTI_VALUED = frozenset({"content"})
+
+
+def _dispatch_keys(tree) -> dict:
+    """``{dimension: keys}`` of the top-level filters of a lowered filter tree"""
+    if tree[0] is _LEAF:
+        nodes = [tree]
+    elif tree[0] is _AND:
+        nodes = tree[1]
+    elif tree[0] is _OR:
+        # any-of filters of one dimension: union of their keys
+        dimensions, keys = set(), set()
+        for node in tree[1]:
+            if node[0] is not _LEAF or (key := getattr(node[1], "dispatch_key", None)) is None:
+                return {}
+            dimensions.add(key[0])
+            keys |= key[1]
+        return {dimensions.pop(): frozenset(keys)} if len(dimensions) == 1 else {}
+    else:
+        return {}
+
+    found = {}
+    for node in nodes:
+        if node[0] is _LEAF and (key := getattr(node[1], "dispatch_key", None)) is not None:
+            dimension, keys = key
+            if dimension not in found:
+                found[dimension] = frozenset(keys)
+            elif dimension not in MULTI_VALUED:
+                # all-of filters of a one-key dimension: intersection of their keys
+                found[dimension] &= keys
+            # else: keys of any operand are enough, an update has all of them
+
+    return found
+
+
+class Router:
+    """
+    Dispatcher of updates to many handlers
+
+    Handlers are indexed by keys of their top-level filters (IDs of ``chat``/``user``,
+    ``content_types``, ``chat_type``, first chars of ``text(startswith=...)``), so an update is
+    checked only by the handlers that can match it, not by every registered handler.
+
+        router = Router()
+
+        @loader.tds
+        class MyModule(loader.Module):
+            @loader.watcher()
+            async def watcher(self, message):
+                await router.feed(self, message)
+
+            @router.handler(chat([ID1, ID2]) & media)
+            async def media_in_chats(self, message):
+                ...
+    """
+    def __init__(self):
+        self.handlers = []  # [(func, plan)]
+        self._index = {}  # dimension -> {key: [handler number]}
+        self._always = []  # handlers numbers without indexed filters
+
+    def register(self, func: Callable, filters: Optional[Filter] = None) -> Callable:
+        """Add a handler, checked with ``filters`` (``None`` - all updates)"""
+        number = len(self.handlers)
+        plan = compile_filter(filters) if filters is not None else None
+        self.handlers.append((func, plan))
+
+        keys = _dispatch_keys(plan.tree) if plan is not None else {}
+        for dimension in DIMENSIONS:
+            if keys.get(dimension):
+                index = self._index.setdefault(dimension, {})
+                for key in keys[dimension]:
+                    index.setdefault(key, []).append(number)
+                break
+        else:
+            self._always.append(number)
+
+        return func
+
+    def handler(self, filters: Optional[Filter] = None) -> Callable[[Callable], Callable]:
+        """Decorator for ``register``"""
+        return lambda func: self.register(func, filters)
+
+    def candidates(self, update) -> List[int]:
+        """Numbers of the handlers that can match the update"""
+        found = set(self._always)
+        for dimension, index in self._index.items():
+            for key in DIMENSIONS[dimension](update):
+                if (numbers := index.get(key)) is not None:
+                    found.update(numbers)
+
+        return sorted(found)
+
+    async def feed(self, _, update, *args, **kwargs) -> int:
+        """
+        Check the update and call all matched handlers (``handler(_, update, *args, **kwargs)``)
+        in the registration order. Returns the number of called handlers.
+        """
+        called = 0
+        for number in self.candidates(update):
+            func, plan = self.handlers[number]
+            if plan is not None and not (
+                await metrics.measure(getattr(func, "__qualname__", str(func)), plan(update, *args, **kwargs))
+                if metrics.active
+                else await plan(update, *args, **kwargs)
+            ):
+                continue
+
+            called += 1
+            try:
+                await func(_, update, *args, **kwargs)
+            except Exception:
+                logger.exception("Handler %s failed", getattr(func, "__name__", func))
+
+        return called
@@ -1,7 +1,21 @@
+import asyncio
+import functools
 import inspect
+import time
+import types
+import weakref
+from concurrent.futures import ThreadPoolExecutor
 from hikkatl.tl.types import User, Chat, Channel, PeerChannel, PeerChat, PeerUser
 import re
-from typing import Optional, Union, Callable, List
+from typing import AsyncIterator, Iterable, Optional, Union, Callable, List, Tuple
+
+from .cache import AdminIndex, AsyncTTLCache, UsernameIndex
+from .context import EvaluationContext, facet, get_context
+from .metrics import FilterMetrics, describe, metrics
+from .offload import MessageSnapshot, register as _register_cpu_bound, run_cpu_bound, set_process_pool
+from .scheduler import RequestDeferred, RequestScheduler, scheduler
+from .throttle import MODES as THROTTLE_MODES, SketchBuckets, TokenBuckets
+from .tracing import Trace, Tracer, tracer
 
 
 class Filter:
@@ -10,111 +24,905 @@ class Filter:
     
     I edited Pyrogram filters.
     """
+    __slots__ = ()
+
     async def __call__(self, update, *args, **kwargs):
         raise NotImplementedError
 
     def __invert__(self):
-        return InvertFilter(self)
+        return _interned(InvertFilter, self)
 
     def __and__(self, other):
-        return AndFilter(self, other)
+        return _interned(AndFilter, self, other)
 
     def __or__(self, other):
-        return OrFilter(self, other)
+        return _interned(OrFilter, self, other)
+
+    async def evaluate_many(self, messages, chunk_size: int = 100) -> List[bool]:
+        """
+        Check many messages (a list or an async iterator like ``client.iter_messages(...)``),
+        returns the list of results
+        """
+        return [result async for _, result in self.iter_evaluate(messages, chunk_size)]
+
+    async def iter_evaluate(self, messages, chunk_size: int = 100) -> AsyncIterator[Tuple[object, bool]]:
+        """
+        Check many messages, yields ``(message, result)``.
+
+        Messages of a chunk are checked concurrently: cheap filters reject most of them before requests,
+        and requests of network filters for the same sender/chat are made once (shared caches).
+        Only one chunk is kept in memory, so it works on long histories.
+        """
+        plan = self._batch_plan()
+        async for chunk in _chunks(messages, chunk_size):
+            results = await asyncio.gather(*(plan(message) for message in chunk))
+            for message, result in zip(chunk, results):
+                yield message, bool(result)
+
+    def _batch_plan(self) -> Callable:
+        """
+        Plan of ``iter_evaluate``, not a new ``FilterPlan`` on every call: a new plan would count
+        the filters as shared and recompile the live plans using them, never recompiled back
+        """
+        code = ((_leaf_op(self), self),)
+        return lambda update: _execute(code, update, (), {})
+
+
+async def _chunks(messages, size: int) -> AsyncIterator[list]:
+    chunk = []
+    if hasattr(messages, "__aiter__"):
+        async for message in messages:
+            chunk.append(message)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+    else:
+        for message in messages:
+            chunk.append(message)
+            if len(chunk) >= size:
+                yield chunk
+                chunk = []
+
+    if chunk:
+        yield chunk
+
+
+# hash-consed filters: (function or combinator class, parameters) -> filter
+_filters = weakref.WeakValueDictionary()
+
+
+def _interned(cls, *args):
+    """The same ``cls(*args)`` for the same (equal) arguments"""
+    try:
+        if (flt := _filters.get(key := (cls, *args))) is not None:
+            return flt
+    except TypeError:
+        # unhashable arguments
+        return cls(*args)
+
+    flt = _filters[key] = cls(*args)
+    return flt
+
+
+_IMMUTABLE_TYPES = (type(None), bool, int, float, complex, str, bytes, range, re.Pattern)
+# compared by identity
+_SHARED_TYPES = (types.FunctionType, types.BuiltinFunctionType, types.MethodType, staticmethod, classmethod)
+
+
+def _is_immutable(value) -> bool:
+    """The value can be shared by equal filters"""
+    if isinstance(value, (tuple, frozenset)):
+        return all(_is_immutable(item) for item in value)
+
+    if isinstance(value, PeerSet):
+        return not value.mutable
+
+    # ``_Affixes`` - prepared patterns of ``text``, never changed after creation
+    return isinstance(value, (*_IMMUTABLE_TYPES, _Affixes)) or isinstance(value, (Filter, *_SHARED_TYPES))
+
+
+def _frozen(value):
+    """Lists of a filter parameter as tuples (so equal filters can be shared)"""
+    return tuple(value) if isinstance(value, list) else value
+
+
+class _CompositeFilter(Filter):
+    """
+    Base of the ``~``, ``&`` and ``|`` filters.
+
+    Direct calls go through a flat plan, compiled on the first call.
+    """
+    __slots__ = ("_plan", "__weakref__")
+
+    async def __call__(self, update, *args, **kwargs):
+        if self._plan is None:
+            self._plan = compile_filter(self)
+
+        return await self._plan(update, *args, **kwargs)
+
+    def _batch_plan(self) -> "FilterPlan":
+        if self._plan is None:
+            self._plan = compile_filter(self)
+
+        return self._plan
 
 
-class InvertFilter(Filter):
+class InvertFilter(_CompositeFilter):
     """
     Invert Class Filter
     
     I edited Pyrogram filters.
     """
+    __slots__ = ("base",)
+
     def __init__(self, base):
         self.base = base
+        self._plan = None
 
-    async def __call__(self, update, *args, **kwargs):
-        if inspect.iscoroutinefunction(self.base.__call__):
-            x = await self.base(update, *args, **kwargs)
-        else:
-            x = await update.client.loop.run_in_executor(
-                None,
-                self.base,
-                update, *args, **kwargs
-            )
 
-        return not x
+class AndFilter(_CompositeFilter):
+    """
+    And Class Filter
+    
+    I edited Pyrogram filters.
+    """
+    __slots__ = ("base", "other")
+
+    def __init__(self, base, other):
+        self.base = base
+        self.other = other
+        self._plan = None
 
 
-class AndFilter(Filter):
+class OrFilter(_CompositeFilter):
     """
-    And Class Filter
+    Or Class Filter
     
     I edited Pyrogram filters.
     """
+    __slots__ = ("base", "other")
+
     def __init__(self, base, other):
         self.base = base
         self.other = other
+        self._plan = None
 
-    async def __call__(self, update, *args, **kwargs):
-        if inspect.iscoroutinefunction(self.base.__call__):
-            x = await self.base(update, *args, **kwargs)
+
+class ConcurrentFilter(_CompositeFilter):
+    """
+    ``&``/``|`` with I/O-bound operands checked concurrently (made by ``concurrently``)
+    """
+    __slots__ = ("base", "timeout", "default")
+
+    def __init__(self, base, timeout, default):
+        self.base = base
+        self.timeout = timeout
+        self.default = default
+        self._plan = None
+
+
+def concurrently(filters: Filter, timeout: Optional[float] = None, default: bool = False) -> ConcurrentFilter:
+    """
+    Check ``io_bound`` operands of ``filters`` (``a | b | ...`` or ``a & b & ...``) concurrently.
+
+    Other operands are checked first, one by one. Then all ``io_bound`` ones are started as tasks:
+    ``|`` returns on the first True, ``&`` on the first False, the rest are cancelled.
+    If they take longer than ``timeout`` seconds, the result is ``default``.
+
+        check_filters(concurrently(chat_admin | user_has_bio, timeout=3))
+    """
+    return _interned(ConcurrentFilter, filters, timeout, default)
+
+
+# Nodes of a lowered filter tree:
+#   (_LEAF, filter) | (_AND, [nodes]) | (_OR, [nodes]) | (_NOT, node)
+_LEAF = "leaf"
+_AND = "and"
+_OR = "or"
+_NOT = "not"
+# (_GROUP, [nodes], _AND or _OR, timeout, default) - nodes checked concurrently
+_GROUP = "group"
+
+# Plan instructions: (opcode, argument). ``x`` is the only register.
+_OP_AWAIT = 0  # x = await arg(update, ...)
+_OP_CALL = 1  # x = arg(update, ...)
+_OP_JUMP_IF_FALSE = 2  # if not x: goto arg
+_OP_JUMP_IF_TRUE = 3  # if x: goto arg
+_OP_NOT = 4  # x = not x
+_OP_BLOCKING = 5  # x = arg(update, ...) in the executor for blocking filters
+_OP_MEMO = 6  # if arg[0] was checked for this update: x = its result, goto arg[1]
+_OP_MEMO_STORE = 7  # remember x as the result of arg for this update
+_OP_CONCURRENT = 8  # x = result of arg = (_AND or _OR, codes, timeout, default), codes run concurrently
+_OP_PROCESS = 9  # x = arg(snapshot of update) in the process pool for cpu_bound filters
+
+_blocking_executor: Optional[ThreadPoolExecutor] = None
+_blocking_workers = 4
+
+
+def set_blocking_executor(max_workers: int = 4):
+    """
+    Set the size of the thread pool for sync filters marked as ``blocking``.
+
+    Other sync filters are cheap checks and run inline, in the event loop.
+    """
+    global _blocking_executor, _blocking_workers
+    if _blocking_executor is not None:
+        _blocking_executor.shutdown(wait=False)
+
+    _blocking_executor = None
+    _blocking_workers = max_workers
+
+
+def _get_blocking_executor() -> ThreadPoolExecutor:
+    global _blocking_executor
+    if _blocking_executor is None:
+        _blocking_executor = ThreadPoolExecutor(_blocking_workers, thread_name_prefix="hikka_filters")
+
+    return _blocking_executor
+
+
+def _is_async(flt) -> bool:
+    if isinstance(flt, FunctionFilter):
+        flt = flt._func
+
+    return inspect.iscoroutinefunction(flt) or inspect.iscoroutinefunction(getattr(flt, "__call__", None))
+
+
+def _leaf_op(flt) -> int:
+    if getattr(flt, "cpu_bound", False):
+        _register_cpu_bound(flt)
+        return _OP_PROCESS
+
+    if _is_async(flt):
+        return _OP_AWAIT
+
+    return _OP_BLOCKING if getattr(flt, "blocking", False) else _OP_CALL
+
+
+def _make_node(kind, children):
+    # memoized nodes (with a third item, the shared filter) are never merged
+    if kind is _NOT:
+        child = children[0]
+        # ~~x -> x
+        return child[1] if child[0] is _NOT and len(child) == 2 else (_NOT, child)
+
+    # (a & b) & c -> &(a, b, c)
+    merged = []
+    for child in children:
+        if child[0] is kind and len(child) == 2:
+            merged.extend(child[1])
         else:
-            x = await update.client.loop.run_in_executor(
-                None,
-                self.base,
-                update, *args, **kwargs
-            )
+            merged.append(child)
+
+    return (kind, merged)
+
+
+def _is_io_bound(tree) -> bool:
+    return any(node[0] is _LEAF and getattr(node[1], "io_bound", False) for node in _postorder(tree))
+
+
+def _make_group(node, flt: ConcurrentFilter):
+    """Split operands of ``concurrently(...)``: others first, then the group of I/O-bound ones"""
+    if node[0] in (_AND, _OR):
+        # a memoized node is split too: its operands are memoized by themselves
+        kind, children = node[:2]
+    else:
+        kind, children = _AND, [node]
+
+    io_bound = [child for child in children if _is_io_bound(child)]
+    if len(io_bound) < 2 and flt.timeout is None:
+        return node
+
+    return (
+        kind,
+        [child for child in children if not _is_io_bound(child)]
+        + [(_GROUP, io_bound, kind, flt.timeout, flt.default)],
+    )
+
+
+def _children(flt) -> Optional[tuple]:
+    if isinstance(flt, (AndFilter, OrFilter)):
+        return (flt.base, flt.other)
+
+    if isinstance(flt, (InvertFilter, ConcurrentFilter)):
+        return (flt.base,)
 
-        # short circuit
-        if not x:
-            return False
+    return None
+
+
+def _lower(flt):
+    """
+    Turn a filter expression into a tree of n-ary nodes without recursion.
 
-        if inspect.iscoroutinefunction(self.other.__call__):
-            y = await self.other(update, *args, **kwargs)
+    Pure filters used by several plans are kept as separate nodes with the filter
+    as the third item: their result is memoized per update.
+    """
+    done = []
+    stack = [(flt, False)]
+    while stack:
+        flt, expanded = stack.pop()
+        if isinstance(flt, FilterPlan):
+            # lowered again, so the trees of plans are never shared
+            stack.append((flt.source, False))
+            continue
+
+        if isinstance(flt, AndFilter):
+            kind, children = _AND, (flt.base, flt.other)
+        elif isinstance(flt, OrFilter):
+            kind, children = _OR, (flt.base, flt.other)
+        elif isinstance(flt, InvertFilter):
+            kind, children = _NOT, (flt.base,)
+        elif isinstance(flt, ConcurrentFilter):
+            kind, children = _GROUP, (flt.base,)
+        else:
+            done.append((_LEAF, flt, flt) if _is_shared(flt) and _is_pure((_LEAF, flt)) else (_LEAF, flt))
+            continue
+
+        if expanded:
+            nodes = done[-len(children):]
+            del done[-len(children):]
+            node = _make_group(nodes[0], flt) if kind is _GROUP else _make_node(kind, nodes)
+            if len(node) == 2 and _is_shared(flt) and _is_pure(node):
+                node = (*node, flt)
+            done.append(node)
+        else:
+            stack.append((flt, True))
+            stack.extend((child, False) for child in reversed(children))
+
+    return done[0]
+
+
+def _emit(tree) -> tuple:
+    """Emit the instructions of a lowered tree (short circuits become forward jumps)"""
+    code = []
+    stack = [(tree, 0, [])]
+    while stack:
+        node, i, jumps = stack.pop()
+        kind = node[0]
+        if len(node) == 3 and i == 0:
+            # memoized node: [MEMO] node [MEMO_STORE]
+            jumps.append(len(code))
+            code.append((_OP_MEMO, None))
+            stack.append((node, -1, jumps))
+            stack.append((node[:2], 0, []))
+        elif i == -1:
+            code.append((_OP_MEMO_STORE, node[2]))
+            code[jumps[0]] = (_OP_MEMO, (node[2], len(code)))
+        elif kind is _GROUP:
+            code.append((_OP_CONCURRENT, (node[2], tuple(_emit(child) for child in node[1]), node[3], node[4])))
+        elif kind is _LEAF:
+            code.append((_leaf_op(node[1]), node[1]))
+        elif kind is _NOT:
+            if i:
+                code.append((_OP_NOT, None))
+            else:
+                stack.append((node, 1, jumps))
+                stack.append((node[1], 0, []))
         else:
-            y = await update.client.loop.run_in_executor(
-                None,
-                self.other,
-                update, *args, **kwargs
+            children = node[1]
+            if 0 < i < len(children):
+                jumps.append(len(code))
+                code.append((_OP_JUMP_IF_FALSE if kind is _AND else _OP_JUMP_IF_TRUE, None))
+
+            if i < len(children):
+                stack.append((node, i + 1, jumps))
+                stack.append((children[i], 0, []))
+            else:
+                for pos in jumps:
+                    code[pos] = (code[pos][0], len(code))
+
+    # a jump landing on a jump with the same condition can go straight to its target,
+    # one landing on the opposite condition always falls through it
+    size = len(code)
+    for pos, (op, target) in enumerate(code):
+        if op != _OP_JUMP_IF_FALSE and op != _OP_JUMP_IF_TRUE:
+            continue
+
+        while target < size and code[target][0] in (_OP_JUMP_IF_FALSE, _OP_JUMP_IF_TRUE):
+            target = code[target][1] if code[target][0] == op else target + 1
+
+        code[pos] = (op, target)
+
+    return tuple(code)
+
+
+def _postorder(tree):
+    """Nodes of a lowered tree, children first"""
+    stack = [(tree, False)]
+    while stack:
+        node, expanded = stack.pop()
+        if node[0] is _LEAF or expanded:
+            yield node
+            continue
+
+        stack.append((node, True))
+        stack.extend((child, False) for child in reversed((node[1],) if node[0] is _NOT else node[1]))
+
+
+def _is_pure(tree) -> bool:
+    return not any(node[0] is _LEAF and getattr(node[1], "side_effects", False) for node in _postorder(tree))
+
+
+# plans using each filter (combinators included), to find the shared ones
+_plan_refs = weakref.WeakKeyDictionary()
+_plans = weakref.WeakSet()
+
+
+def _expression_filters(flt) -> list:
+    """Filters of an expression, each once (plans are replaced by their source)"""
+    seen, found, stack = set(), [], [flt]
+    while stack:
+        flt = stack.pop()
+        if id(flt) in seen:
+            continue
+
+        seen.add(id(flt))
+        if isinstance(flt, FilterPlan):
+            stack.append(flt.source)
+            continue
+
+        found.append(flt)
+        stack.extend(_children(flt) or ())
+
+    return found
+
+
+def _is_shared(flt) -> bool:
+    try:
+        return _plan_refs.get(flt, 0) > 1
+    except TypeError:
+        return False
+
+
+def _unshare(filters: list):
+    """A plan using ``filters`` is gone"""
+    for flt in filters:
+        try:
+            if (refs := _plan_refs.get(flt)) is not None:
+                _plan_refs[flt] = refs - 1
+        except TypeError:
+            continue
+
+
+def _share(filters: list) -> list:
+    """Count a new plan using ``filters``, returns the filters which became shared"""
+    became_shared = []
+    for flt in filters:
+        try:
+            refs = _plan_refs[flt] = _plan_refs.get(flt, 0) + 1
+        except TypeError:
+            # no weakrefs/hash support, never memoized
+            continue
+
+        if refs == 2:
+            became_shared.append(flt)
+
+    return became_shared
+
+
+def _sort_pure(children: list, key: Callable, is_pure: Callable):
+    """Sort runs of pure operands between operands with side effects"""
+    start = 0
+    for end in range(len(children) + 1):
+        if end == len(children) or not is_pure(children[end]):
+            children[start:end] = sorted(children[start:end], key=key)
+            start = end + 1
+
+
+def _order_by_tier(tree):
+    """Pure operands on raw fields go before ones on entities, these - before ones making requests"""
+    tiers = {}  # id(node) -> (tier, pure)
+    for node in _postorder(tree):
+        if node[0] is _LEAF:
+            tiers[id(node)] = (getattr(node[1], "tier", TIER_ENTITY), not getattr(node[1], "side_effects", False))
+            continue
+
+        children = (node[1],) if node[0] is _NOT else node[1]
+        if node[0] is _AND or node[0] is _OR:
+            _sort_pure(children, lambda child: tiers[id(child)][0], lambda child: tiers[id(child)][1])
+
+        tiers[id(node)] = (
+            max(tiers[id(child)][0] for child in children),
+            all(tiers[id(child)][1] for child in children),
+        )
+
+
+DEFAULT_COST = 0.00001
+"""Expected time (seconds) of a check for filters without ``cost`` hint and measurements"""
+
+
+def _reorder(tree, stats: dict):
+    """
+    Sort pure children of n-ary nodes: the cheapest and most selective first.
+
+    Filters with ``side_effects`` stay in place, pure ones never move across them.
+    """
+    estimates = {}  # id(node) -> (cost, pass rate, pure)
+    for node in _postorder(tree):
+        kind = node[0]
+        if kind is _LEAF:
+            flt = node[1]
+            calls, passes, seconds = stats.get(id(flt), (0, 0, 0.0))
+            estimates[id(node)] = (
+                seconds / calls if calls else getattr(flt, "cost", DEFAULT_COST),
+                (passes + 1) / (calls + 2),
+                not getattr(flt, "side_effects", False),
+            )
+            continue
+
+        if kind is _NOT:
+            cost, rate, pure = estimates[id(node[1])]
+            estimates[id(node)] = (cost, 1 - rate, pure)
+            continue
+
+        if kind is _GROUP:
+            # concurrent: as slow as the slowest one
+            reach = 1.0
+            for child in node[1]:
+                reach *= estimates[id(child)][1] if node[2] is _AND else 1 - estimates[id(child)][1]
+
+            estimates[id(node)] = (
+                max(estimates[id(child)][0] for child in node[1]),
+                reach if node[2] is _AND else 1 - reach,
+                all(estimates[id(child)][2] for child in node[1]),
             )
+            continue
+
+        children = node[1]
+        if kind is _AND:
+            rank = lambda child: estimates[id(child)][0] / max(1 - estimates[id(child)][1], 0.001)
+        else:
+            rank = lambda child: estimates[id(child)][0] / max(estimates[id(child)][1], 0.001)
+
+        _sort_pure(children, rank, lambda child: estimates[id(child)][2])
 
-        return x and y
+        # expected cost with short circuits, chance to pass
+        cost, reach = 0.0, 1.0
+        for child in children:
+            child_cost, child_rate, _ = estimates[id(child)]
+            cost += reach * child_cost
+            reach *= child_rate if kind is _AND else 1 - child_rate
 
+        estimates[id(node)] = (
+            cost,
+            reach if kind is _AND else 1 - reach,
+            all(estimates[id(child)][2] for child in children),
+        )
 
-class OrFilter(Filter):
+
+def _operands(node) -> tuple:
+    return (node[1],) if node[0] is _NOT else node[1]
+
+
+def _node_name(node) -> str:
+    return f"concurrently({node[2]})" if node[0] is _GROUP else node[0]
+
+
+def _skipped(tree) -> dict:
+    entries = {}  # id(node) -> entry
+    for node in _postorder(tree):
+        if node[0] is _LEAF:
+            entries[id(node)] = {"filter": describe(node[1]), "ran": False}
+        else:
+            entries[id(node)] = {
+                "op": _node_name(node),
+                "ran": False,
+                "children": [entries.pop(id(child)) for child in _operands(node)],
+            }
+
+    return entries[id(tree)]
+
+
+def _explain(tree, trace: Trace, memo: dict) -> dict:
     """
-    Or Class Filter
-    
-    I edited Pyrogram filters.
+    Evaluation path of a traced check: every node of the tree with ``ran``, ``result`` and ``seconds``
+
+    The check is replayed in its order: operands after a short circuit are skipped,
+    recorded steps of filters are taken in the order they ran, results of memoized nodes - from ``memo``.
     """
-    def __init__(self, base, other):
-        self.base = base
-        self.other = other
+    stack = [[tree, [], 0]]  # [node, entries of its operands, next operand]
+    while stack:
+        frame = stack[-1]
+        node, children, i = frame
+        kind = node[0]
+        if kind is _LEAF:
+            stack.pop()
+            if (entry := trace.pop(node[1])) is None:
+                entry = {"filter": describe(node[1]), "ran": False}
+                if len(node) == 3 and node[2] in memo:
+                    entry.update(ran=True, memo=True, result=bool(memo[node[2]]), seconds=0.0)
+        else:
+            operands = _operands(node)
+            if i < len(operands) and (
+                i == 0
+                or kind is _GROUP
+                # no short circuit yet
+                or kind is not _NOT and children[-1]["ran"] and children[-1]["result"] == (kind is _AND)
+            ):
+                frame[2] += 1
+                stack.append([operands[i], [], 0])
+                continue
+
+            stack.pop()
+            children.extend(_skipped(operand) for operand in operands[i:])
+            ran = [child for child in children if child["ran"]]
+            entry = {"op": _node_name(node), "ran": bool(ran)}
+            if ran and kind is _NOT:
+                entry.update(result=not ran[0]["result"], seconds=ran[0]["seconds"])
+            elif ran:
+                operator = node[2] if kind is _GROUP else kind
+                entry.update(
+                    result=(all if operator is _AND else any)(child["result"] for child in ran),
+                    seconds=(max if kind is _GROUP else sum)(child["seconds"] for child in ran),
+                )
+            elif len(node) == 3 and node[2] in memo:
+                entry.update(ran=True, memo=True, result=bool(memo[node[2]]), seconds=0.0)
+
+            entry["children"] = children
+
+        if not stack:
+            return entry
+
+        stack[-1][1].append(entry)
+
+
+class FilterPlan(Filter):
+    """
+    Compiled filter (made by ``compile_filter``)
+
+    Chained ``&``/``|`` are merged into n-ary nodes, ``~~x`` is folded to ``x``,
+    sync/async is decided once per filter and an update is checked by one flat loop.
+    Sync filters are called inline, only ``blocking`` ones go to a bounded thread pool.
+
+    Pure operands are ordered by ``tier``: filters on raw fields of the update first, then ones
+    on entities, then ones making requests, so most updates are rejected without entity lookups.
+
+    ``adaptive`` plans measure time and pass rate of each filter and reorder
+    pure operands of ``&``/``|`` every ``reorder_every`` checks (see ``_reorder``).
+    """
+    __slots__ = ("source", "adaptive", "reorder_every", "stats", "tree", "code", "_checks", "_filter_ids", "__weakref__")
+
+    def __init__(self, filters: Filter, adaptive: bool = False, reorder_every: int = 1000):
+        self.source = filters
+        self.adaptive = adaptive
+        self.reorder_every = reorder_every
+        self.stats = {}  # id(filter) -> [calls, passes, seconds]
+        self._checks = 0
+
+        _filters = _expression_filters(filters)
+        self._filter_ids = {id(flt) for flt in _filters}
+        became_shared = _share(_filters)
+        weakref.finalize(self, _unshare, _filters)
+        self._compile()
+        for plan in list(_plans):
+            # their copies of the newly shared filters must be memoized too
+            if any(id(flt) in plan._filter_ids for flt in became_shared):
+                plan._compile()
+
+        _plans.add(self)
+
+    def _batch_plan(self) -> "FilterPlan":
+        return self
+
+    def _compile(self):
+        self.tree = _lower(self.source)
+        if self.adaptive:
+            _reorder(self.tree, self.stats)
+        else:
+            _order_by_tier(self.tree)
+
+        self.code = _emit(self.tree)
+
+    def reorder(self):
+        """Reorder operands by the collected stats now (old stats weigh half after it)"""
+        _reorder(self.tree, self.stats)
+        self.code = _emit(self.tree)
+        for stat in self.stats.values():
+            stat[0] //= 2
+            stat[1] //= 2
+            stat[2] /= 2
 
     async def __call__(self, update, *args, **kwargs):
-        if inspect.iscoroutinefunction(self.base.__call__):
-            x = await self.base(update, *args, **kwargs)
+        if metrics.active or self.adaptive:
+            return await self._call_measured(update, args, kwargs)
+
+        return await _execute(self.code, update, args, kwargs)
+
+    async def _call_measured(self, update, args: tuple, kwargs: dict):
+        if metrics.tracing and get_context(update).traced:
+            x = await self._call_traced(update, args, kwargs)
+        else:
+            x = await _execute_measured(self.code, update, args, kwargs, self._record)
+
+        if self.adaptive:
+            self._checks += 1
+            if self._checks >= self.reorder_every:
+                self._checks = 0
+                self.reorder()
+
+        return x
+
+    def _record(self, flt, op: int, x, seconds: float):
+        if self.adaptive:
+            if (stat := self.stats.get(id(flt))) is None:
+                stat = self.stats[id(flt)] = [0, 0, 0.0]
+
+            stat[0] += 1
+            stat[1] += bool(x)
+            stat[2] += seconds
+
+        if metrics.enabled:
+            metrics.record(flt, x, seconds, offloaded=op == _OP_BLOCKING or op == _OP_PROCESS)
+
+    async def _call_traced(self, update, args: tuple, kwargs: dict):
+        trace = Trace()
+
+        def record(flt, op, x, seconds):
+            self._record(flt, op, x, seconds)
+            trace.record(flt, x, seconds, offloaded=op == _OP_BLOCKING or op == _OP_PROCESS)
+
+        token = metrics.trace.set(trace)
+        started = time.perf_counter()
+        try:
+            x = await _execute_measured(self.code, update, args, kwargs, record)
+        finally:
+            metrics.trace.reset(token)
+
+        tracer.add(
+            {
+                "time": time.time(),
+                "handler": metrics.handler.get(),
+                "update": {
+                    "id": getattr(update, "id", None),
+                    "chat_id": _peer_id(getattr(update, "peer_id", None)),
+                    "sender_id": getattr(update, "sender_id", None),
+                },
+                "result": bool(x),
+                "seconds": time.perf_counter() - started,
+                "order": [step["filter"] for step in trace.order],
+                "path": _explain(self.tree, trace, get_context(update).memo),
+            }
+        )
+        return x
+
+
+async def _execute(code: tuple, update, args: tuple, kwargs: dict):
+    size = len(code)
+    pc = 0
+    x = False
+    while pc < size:
+        op, arg = code[pc]
+        pc += 1
+        if op == _OP_AWAIT:
+            x = await arg(update, *args, **kwargs)
+        elif op == _OP_CALL:
+            x = arg(update, *args, **kwargs)
+        elif op == _OP_JUMP_IF_FALSE:
+            if not x:
+                pc = arg
+        elif op == _OP_JUMP_IF_TRUE:
+            if x:
+                pc = arg
+        elif op == _OP_NOT:
+            x = not x
+        elif op == _OP_MEMO:
+            if (memo := get_context(update).memo).get(arg[0], memo) is not memo:
+                x = memo[arg[0]]
+                pc = arg[1]
+        elif op == _OP_MEMO_STORE:
+            get_context(update).memo[arg] = x
+        elif op == _OP_CONCURRENT:
+            x = await _run_concurrently(arg, update, args, kwargs)
+        elif op == _OP_PROCESS:
+            x = await run_cpu_bound(arg, update)
         else:
-            x = await update.client.loop.run_in_executor(
-                None,
-                self.base,
-                update, *args, **kwargs
+            x = await asyncio.get_running_loop().run_in_executor(
+                _get_blocking_executor(),
+                functools.partial(arg, update, *args, **kwargs),
             )
 
-        # short circuit
-        if x:
-            return True
-
-        if inspect.iscoroutinefunction(self.other.__call__):
-            y = await self.other(update, *args, **kwargs)
+    return x
+
+
+async def _execute_measured(code: tuple, update, args: tuple, kwargs: dict, record: Callable):
+    """``_execute`` calling ``record(filter, opcode, result, seconds)`` after each filter check"""
+    size = len(code)
+    pc = 0
+    x = False
+    while pc < size:
+        op, arg = code[pc]
+        pc += 1
+        if op == _OP_JUMP_IF_FALSE:
+            if not x:
+                pc = arg
+        elif op == _OP_JUMP_IF_TRUE:
+            if x:
+                pc = arg
+        elif op == _OP_NOT:
+            x = not x
+        elif op == _OP_MEMO:
+            if (memo := get_context(update).memo).get(arg[0], memo) is not memo:
+                x = memo[arg[0]]
+                pc = arg[1]
+        elif op == _OP_MEMO_STORE:
+            get_context(update).memo[arg] = x
+        elif op == _OP_CONCURRENT:
+            x = await _run_concurrently(arg, update, args, kwargs, record)
         else:
-            y = await update.client.loop.run_in_executor(
-                None,
-                self.other,
-                update, *args, **kwargs
+            # requests made by the check are counted for this filter
+            token = metrics.current.set(arg)
+            started = time.perf_counter()
+            try:
+                x = await _run_leaf(op, arg, update, *args, **kwargs)
+            finally:
+                metrics.current.reset(token)
+
+            record(arg, op, x, time.perf_counter() - started)
+
+    return x
+
+
+async def _run_concurrently(group: tuple, update, args: tuple, kwargs: dict, record: Optional[Callable] = None):
+    kind, codes, timeout, default = group
+    loop = asyncio.get_running_loop()
+    deadline = None if timeout is None else loop.time() + timeout
+    pending = {
+        asyncio.ensure_future(
+            _execute(code, update, args, kwargs) if record is None else _execute_measured(code, update, args, kwargs, record)
+        )
+        for code in codes
+    }
+    x = kind is _AND
+    try:
+        while pending:
+            done, pending = await asyncio.wait(
+                pending,
+                timeout=None if deadline is None else max(deadline - loop.time(), 0),
+                return_when=asyncio.FIRST_COMPLETED,
             )
+            if not done:
+                return default
+
+            for task in done:
+                x = task.result()
+                if (kind is _OR) == bool(x):
+                    # short circuit
+                    return x
+
+        return x
+    finally:
+        for task in pending:
+            task.cancel()
 
-        return x or y
+
+async def _run_leaf(op: int, flt, update, *args, **kwargs):
+    if op == _OP_AWAIT:
+        return await flt(update, *args, **kwargs)
+
+    if op == _OP_CALL:
+        return flt(update, *args, **kwargs)
+
+    if op == _OP_PROCESS:
+        return await run_cpu_bound(flt, update)
+
+    return await asyncio.get_running_loop().run_in_executor(
+        _get_blocking_executor(),
+        functools.partial(flt, update, *args, **kwargs),
+    )
+
+
+def compile_filter(filters: Filter, adaptive: bool = False) -> FilterPlan:
+    """
+    Compile a filter expression into a ``FilterPlan``.
+
+    ``check_filters`` and ``command`` do it once, when decorating the handler.
+    ``adaptive=True`` - reorder operands of ``&``/``|`` by measured cost and pass rate
+    (filters with ``side_effects`` keep their place, ``cost`` is the static hint in seconds).
+    """
+    if isinstance(filters, FilterPlan):
+        return filters
+
+    return FilterPlan(filters, adaptive=adaptive)
 
 
 def create_filter(func: Callable, **kwargs) -> Filter:
@@ -128,25 +936,139 @@ def create_filter(func: Callable, **kwargs) -> Filter:
             Useful when creating parameterized custom filters, such as
             :meth:`~hikka_filters.chat` or :meth:`~hikka_filters.user`.
         
+        blocking (``bool``, optional): Sync ``func`` is slow (I/O, heavy CPU work) and must run in a thread pool
+            (see ``set_blocking_executor``). Other sync filters are called inline.
+        
+        side_effects (``bool``, optional): ``func`` changes the update (like ``args`` sets ``msg.args``),
+            adaptive plans never move other filters across it.
+        
+        cost (``float``, optional): Expected time of a check in seconds (e.g. of a network request),
+            used by adaptive plans before they measure it.
+        
+        tier (``int``, optional): ``TIER_RAW`` (only raw fields of the update), ``TIER_ENTITY`` (default, uses
+            ``msg.sender``/``msg.chat``) or ``TIER_NETWORK`` (makes requests). Plans check lower tiers first.
+        
+        io_bound (``bool``, optional): ``func`` waits for network requests, ``concurrently`` starts such filters together.
+        
+        cpu_bound (``bool``, optional): Sync ``func`` is CPU-heavy and runs in a process pool (see ``set_process_pool``).
+            It gets a picklable ``MessageSnapshot`` instead of the message, so it must be a module-level function
+            with picklable kwargs; when the pool is saturated, it runs inline.
+        
+        dynamic (``bool``, optional): The filter has a ``__dict__``, so attributes can be set on it at runtime.
+        
+        dispatch_key (``tuple``, optional): ``(dimension, keys)`` - the filter passes only updates with one
+            of ``keys`` in ``dimension``, used by ``Router`` to index handlers (see ``hikka_filters.dispatcher``).
+        
+    Facts about the update, computed by several filters, can be memoized per update: see ``facet`` and ``get_context``.
+    
+    Filters are hash-consed: the same ``func`` with equal kwargs gives the same filter,
+    and its result is computed once per update for all handlers using it. Only immutable kwargs (numbers, strings,
+    tuples, frozensets, functions...) are compared: filters with a list, set, dict or other mutable kwarg
+    (private ``_``-prefixed ones too, and ``dynamic`` filters) are never shared.
+    
+    Kwargs are attributes of the filter (``flt.users``, functions are bound as methods), kept in ``__slots__``:
+    other attributes can't be set on the filter, unless it is created with ``dynamic=True`` (then it has a ``__dict__``).
+        
     I edited Pyrogram filters.
     """
     
-    return type(
-        func.__name__ or "Custom_Filter",
-        (Filter,),
-        {"__call__": func, **kwargs}
-    )()
+    factory = _FilterFactory(func, kwargs)
+    if kwargs.get("dynamic") or not all(_is_immutable(value) for value in kwargs.values()):
+        # separate filters must not share their state
+        return factory(None)
+
+    return _interned(factory, frozenset(kwargs.items()))
+
+
+class FunctionFilter(Filter):
+    """
+    Filter made by ``create_filter``: ``func(flt, update)``, kwargs are attributes
+
+    Filters with the same kwarg names share one subclass with these names as ``__slots__``,
+    so a filter has no ``__dict__`` (unless ``dynamic=True``) and filters made at runtime
+    (per chat, per rule) make no new classes.
+    """
+    __slots__ = ("_func", "__weakref__")
+    _params = ()  # names of the kwargs
+
+    def __init__(self, func: Callable, kwargs: dict):
+        self._func = func
+        for name, value in kwargs.items():
+            if isinstance(value, staticmethod):
+                value = value.__func__
+            elif isinstance(value, (types.FunctionType, classmethod)):
+                # as a class attribute of the filter would be
+                value = value.__get__(self, type(self))
+
+            setattr(self, name, value)
+
+    def __call__(self, update, *args, **kwargs):
+        # the coroutine of an async ``func`` is returned as is, without a wrapping one
+        return self._func(self, update, *args, **kwargs)
+
+    def __repr__(self):
+        return f"<{self._func.__qualname__} filter at {id(self):#x}>"
+
+
+# kwarg names -> FunctionFilter subclass with them as slots
+_function_filter_classes = {}
+
+
+def _function_filter_class(names: Iterable[str], dynamic: bool = False) -> type:
+    if (cls := _function_filter_classes.get(key := (tuple(sorted(names)), dynamic))) is None:
+        names = key[0]
+        if reserved := {"_func", "_params", "__dict__"}.intersection(names):
+            raise TypeError(f"{', '.join(reserved)} can't be passed to create_filter")
+
+        cls = _function_filter_classes[key] = type(
+            "FunctionFilter",
+            (FunctionFilter,),
+            {"__slots__": (*names, "__dict__") if dynamic else names, "_params": names},
+        )
+
+    return cls
+
+
+class _FilterFactory:
+    """Makes the filter of ``create_filter``; equal for the same function"""
+    def __init__(self, func: Callable, kwargs: dict):
+        self.func = func
+        self.kwargs = kwargs
+
+    def __eq__(self, other):
+        return isinstance(other, _FilterFactory) and self.func is other.func
+
+    def __hash__(self):
+        return hash(self.func)
+
+    def __call__(self, _):
+        return _function_filter_class(self.kwargs, bool(self.kwargs.get("dynamic")))(self.func, self.kwargs)
 
 
-def check_filters(filters: Union[Filter, AndFilter, OrFilter, InvertFilter]):
+@facet("memo")
+def _memo_facet(update) -> dict:
+    """Results of shared filters for the update"""
+    return {}
+
+
+def check_filters(filters: Union[Filter, AndFilter, OrFilter, InvertFilter], adaptive: bool = False):
     """
     Pass the filters from ``hikka_filters.filters`` or custom filters(created by ``hikka_filters.filters.create_filter(func, **kwargs)``)
     to check the update on filters.
+    
+    ``adaptive=True`` - reorder operands of ``&``/``|`` at runtime (see ``compile_filter``).
     """
     
     def decorator(func):
+        plan = compile_filter(filters, adaptive=adaptive)
+        name = func.__qualname__
+
         async def checking_filters(_, update, *args, **kwargs):
-            if (await filters(update, *args, **kwargs)):
+            if (
+                await metrics.measure(name, plan(update, *args, **kwargs))
+                if metrics.active
+                else await plan(update, *args, **kwargs)
+            ):
                 return await func(_, update, *args, **kwargs)
             else:
                 return False
@@ -156,55 +1078,365 @@ def check_filters(filters: Union[Filter, AndFilter, OrFilter, InvertFilter]):
     return decorator
 
 
-def user(users: Union[int, str, List[Union[int, str]]]):
-    """User Filter (:param:users (``int`` | ``str`` | ``list[`int` | `str`]`` - users IDs/usernames)"""
-    users = users if isinstance(users, list) else [users]
-    
-    async def user_filter(flt, msg):
-        if not (msg.sender and isinstance(msg.sender, User)):
-            return False
-        
-        for user in flt.users:
-            if isinstance(user, str) and hasattr(msg.sender, "username") and msg.sender.username:
-                if user.lower() == msg.sender.username.lower():
-                    return True
-            elif isinstance(user, int):
-                if msg.sender.id == user:
-                    return True
-        
+username_index = UsernameIndex()
+"""IDs of usernames of ``user``/``chat`` filters (``username_index.load("usernames.json")`` to keep them between restarts)"""
+
+
+class PeerSet:
+    """
+    IDs and usernames for ``user``/``chat`` filters
+
+    Kept as a set of IDs and a set of lowercased usernames. Usernames are resolved to IDs
+    by ``username_index`` in the background after the first check (until then they are compared
+    with the username of the entity), then a check is one hash lookup of the ID.
+    ``mutable=True`` allows ``add``/``remove`` at runtime, without rebuilding the filter.
+    """
+    def __init__(self, peers: List[Union[int, str]] = (), mutable: bool = False):
+        self.mutable = mutable
+        ids = {peer for peer in peers if isinstance(peer, int)}
+        usernames = {self._username(peer) for peer in peers if isinstance(peer, str)}
+        self.ids = ids if mutable else frozenset(ids)
+        self.usernames = usernames if mutable else frozenset(usernames)
+        self.unresolved = frozenset(usernames)  # usernames without known IDs
+        self._ids = frozenset(ids)  # IDs and IDs of resolved usernames
+        self._version = None  # of ``username_index`` when ``_ids`` were built
+
+    _username = staticmethod(UsernameIndex.normalize)
+
+    def _check_mutable(self):
+        if not self.mutable:
+            raise TypeError("PeerSet is frozen, pass `mutable=True` to the filter to change it at runtime")
+
+    def add(self, *peers: Union[int, str]):
+        self._check_mutable()
+        for peer in peers:
+            if isinstance(peer, int):
+                self.ids.add(peer)
+            else:
+                self.usernames.add(self._username(peer))
+
+        self._version = None
+
+    def remove(self, *peers: Union[int, str]):
+        self._check_mutable()
+        for peer in peers:
+            if isinstance(peer, int):
+                self.ids.discard(peer)
+            else:
+                self.usernames.discard(self._username(peer))
+
+        self._version = None
+
+    def resolve(self, client) -> frozenset:
+        """IDs and IDs of the resolved usernames (others are resolved in the background, if there is a client)"""
+        if self._version == username_index.version:
+            return self._ids
+
+        if client is not None:
+            username_index.resolve(client, self.usernames)
+
+        resolved = username_index.ids(self.usernames)
+        self._ids = frozenset({*self.ids, *(peer_id for peer_id in resolved.values() if peer_id is not None)})
+        self.unresolved = frozenset(username for username, peer_id in resolved.items() if peer_id is None)
+        if client is not None:
+            self._version = username_index.version
+
+        return self._ids
+
+    def match_username(self, entity) -> bool:
+        """The entity has one of the usernames not resolved to IDs"""
+        return bool(username := getattr(entity, "username", None)) and username.lower() in self.unresolved
+
+    def __len__(self):
+        return len(self.ids) + len(self.usernames)
+
+    def __eq__(self, other):
+        if self.mutable or not isinstance(other, PeerSet) or other.mutable:
+            return self is other
+
+        return self.ids == other.ids and self.usernames == other.usernames
+
+    def __hash__(self):
+        return id(self) if self.mutable else hash((self.ids, self.usernames))
+
+    def dispatch_key(self, dimension: str) -> Optional[tuple]:
+        """Key for ``Router`` index (only frozen sets of IDs can be indexed)"""
+        return None if self.mutable or self.usernames else (dimension, self.ids)
+
+
+def _peer_id(peer) -> Optional[int]:
+    """ID of a user/chat/channel (as ``entity.id``) from a raw ``Peer*``"""
+    if isinstance(peer, PeerChannel):
+        return peer.channel_id
+    if isinstance(peer, PeerChat):
+        return peer.chat_id
+    if isinstance(peer, PeerUser):
+        return peer.user_id
+    return None
+
+
+def _from_user(msg) -> bool:
+    """Sender is a user (by raw ``sender_id``, channels and chats have negative IDs)"""
+    return (sender_id := getattr(msg, "sender_id", None)) is not None and sender_id > 0
+
+
+TIER_RAW = 0
+"""Filters on raw fields of the update (``sender_id``, ``peer_id``, ``fwd_from``, ``media``, ``via_bot_id``...)"""
+TIER_ENTITY = 1
+"""Filters on entities (``msg.sender``, ``msg.chat``), the default one"""
+TIER_NETWORK = 2
+"""Filters making requests"""
+
+
+async def user_filter(flt, msg):
+    if not _from_user(msg):
         return False
+
+    if msg.sender_id in (peers := flt.peers).ids:
+        return True
+
+    if not peers.usernames or msg.sender_id not in peers.resolve(getattr(msg, "client", None)):
+        # entity is needed only for usernames which are not resolved
+        return bool(peers.unresolved) and isinstance(sender := msg.sender, User) and peers.match_username(sender)
+
+    return True
+
+
+def user(users: Union[int, str, List[Union[int, str]]], mutable: bool = False):
+    """
+    User Filter (:param:users (``int`` | ``str`` | ``list[`int` | `str`]`` - users IDs/usernames)
+
+    Usernames are resolved to IDs in the background (``username_index``), then only IDs are compared
+
+    ``mutable=True`` - change users at runtime: ``flt.peers.add(...)``/``flt.peers.remove(...)``
+    """
+    users = tuple(users) if isinstance(users, (list, tuple)) else (users,)
     
-    return create_filter(user_filter, users=users)
+    peers = PeerSet(users, mutable)
+    return create_filter(
+        user_filter,
+        users=users,
+        peers=peers,
+        dispatch_key=peers.dispatch_key("sender"),
+        tier=TIER_ENTITY if peers.usernames else TIER_RAW,
+    )
+
+
+async def chat_filter(flt, msg):
+    if (chat_id := _peer_id(getattr(msg, "peer_id", None))) is None:
+        return False
+
+    if chat_id in (peers := flt.peers).ids:
+        return True
+
+    if not peers.usernames or chat_id not in peers.resolve(getattr(msg, "client", None)):
+        return bool(peers.unresolved) and isinstance(_chat := msg.chat, (Channel, User, Chat)) and peers.match_username(_chat)
+
+    return True
 
 
-def chat(chats: Union[int, str, List[Union[int, str]]]):
+def chat(chats: Union[int, str, List[Union[int, str]]], mutable: bool = False):
     """
     Chat Filter
     :param:chats (``int`` | ``str`` | ``list[`int` | `str`]`` - chats IDs/usernames)
+    
+    Usernames are resolved to IDs in the background (``username_index``), then only IDs are compared
+    
+    ``mutable=True`` - change chats at runtime: ``flt.peers.add(...)``/``flt.peers.remove(...)``
     """
-    chats = chats if isinstance(chats, list) else [chats]
+    chats = tuple(chats) if isinstance(chats, (list, tuple)) else (chats,)
     
-    async def chat_filter(flt, msg):
-        if not (
-            msg.chat and (
-                isinstance(msg.chat, Channel)
-                or isinstance(msg.chat, User)
-                or isinstance(msg.chat, Chat)
-            )
-        ):
-            return False
-        
-        for chat in flt.chats:
-            if isinstance(chat, str) and hasattr(msg.chat, "username") and msg.chat.username:
-                if chat.lower() == msg.chat.username.lower():
-                    return True
-            elif isinstance(chat, int):
-                if msg.chat.id == chat:
-                    return True
-        
+    peers = PeerSet(chats, mutable)
+    return create_filter(
+        chat_filter,
+        chats=chats,
+        peers=peers,
+        dispatch_key=peers.dispatch_key("chat"),
+        tier=TIER_ENTITY if peers.usernames else TIER_RAW,
+    )
+
+
+def _sender_key(msg) -> Optional[int]:
+    return getattr(msg, "sender_id", None)
+
+
+def _chat_key(msg) -> Optional[int]:
+    return _peer_id(getattr(msg, "peer_id", None))
+
+
+_THROTTLE_KEYS = {"sender": _sender_key, "chat": _chat_key}
+
+# throttles shared by ``name``: parameters -> filter
+_named_throttles = weakref.WeakValueDictionary()
+
+
+async def throttle_filter(flt, msg):
+    # one token per update, however many handlers check it
+    if (memo := get_context(msg).memo).get(flt, memo) is not memo:
+        return memo[flt]
+
+    result = memo[flt] = (key := flt._key_func(msg)) is None or flt._buckets.take(key, time.monotonic())
+    return result
+
+
+def throttle(
+    rate: float,
+    burst: Optional[float] = None,
+    key: Union[str, Callable] = "sender",
+    maxkeys: int = 100000,
+    mode: str = "lru",
+    name: Optional[str] = None,
+):
+    """
+    Rate limit Filter: passes ``rate`` updates per second of each key (``burst`` at once, default: ``max(1, rate)``)
+    :param:key (``"sender"`` | ``"chat"`` | ``callable``) - sender ID, chat ID or ``key(update)`` (``None`` - not limited)
+    :param:mode (``"lru"`` | ``"sketch"``) - buckets of ``maxkeys`` recent keys (others are evicted)
+        or a count-min sketch of ``maxkeys`` cells (any number of keys, approximate)
+
+    Memory is fixed by ``maxkeys``. Put it before expensive filters: ``throttle(1, 5) & media & user_has_bio``.
+    Every call makes a throttle with its own buckets; equal throttles with the same ``name``
+    are one filter, so the handlers using them share the limit.
+    """
+    if mode not in THROTTLE_MODES:
+        raise ValueError(f"Mode must be one of {THROTTLE_MODES}, not {mode!r}")
+
+    if (key_func := _THROTTLE_KEYS.get(key, key)) is key and not callable(key):
+        raise ValueError(f"Key must be one of {tuple(_THROTTLE_KEYS)} or a function, not {key!r}")
+
+    burst = max(1, rate) if burst is None else burst
+    if burst < 1:
+        raise ValueError(f"Burst must be at least 1, not {burst!r}")
+
+    params = (rate, burst, key, maxkeys, mode, name)
+    if name is not None and (flt := _named_throttles.get(params)) is not None:
+        return flt
+
+    # never interned: ``_buckets`` is mutable
+    flt = create_filter(
+        throttle_filter,
+        rate=rate,
+        burst=burst,
+        key=key,
+        maxkeys=maxkeys,
+        mode=mode,
+        name=name,
+        _key_func=staticmethod(key_func),
+        _buckets=(
+            TokenBuckets(rate, burst, maxkeys)
+            if mode == "lru"
+            else SketchBuckets(rate, burst, width=max(1, maxkeys // 4), depth=4)
+        ),
+        side_effects=True,
+        tier=TIER_RAW,
+    )
+    if name is not None:
+        _named_throttles[params] = flt
+
+    return flt
+
+
+class _Affixes:
+    """
+    Prefixes or suffixes of ``text`` filter
+
+    Patterns are bucketed by length: a check is one set lookup per distinct length,
+    whatever the number of patterns.
+    """
+    def __init__(self, patterns):
+        self.patterns = frozenset(patterns)
+        self.lengths = tuple(sorted({len(pattern) for pattern in self.patterns if pattern}))
+        self.empty = "" in self.patterns
+
+    def __eq__(self, other):
+        return isinstance(other, _Affixes) and self.patterns == other.patterns
+
+    def __hash__(self):
+        return hash(self.patterns)
+
+    def starts(self, text: str) -> bool:
+        if self.empty:
+            return True
+
+        patterns = self.patterns
+        for length in self.lengths:
+            if length > len(text):
+                break
+            if text[:length] in patterns:
+                return True
+
         return False
-    
-    return create_filter(chat_filter, chats=chats)
+
+    def ends(self, text: str) -> bool:
+        if self.empty:
+            return True
+
+        patterns = self.patterns
+        for length in self.lengths:
+            if length > len(text):
+                break
+            if text[-length:] in patterns:
+                return True
+
+        return False
+
+
+def _as_tuple(value) -> tuple:
+    return (value,) if isinstance(value, str) else tuple(value)
+
+
+@facet("text")
+def _text_facet(msg) -> Optional[str]:
+    return msg.text
+
+
+@facet("text_lower")
+def _text_lower_facet(msg) -> Optional[str]:
+    return None if (_text := get_context(msg).text) is None else _text.lower()
+
+
+async def check_text(flt, msg):
+    ctx = get_context(msg)
+    if (_text := ctx.text) is None:
+        return False
+
+    if flt._exact is not None:
+        return _text in flt._exact
+
+    if flt._regexes is not None:
+        for find in flt._regexes:
+            if (_match := find(_text)):
+                setattr(msg, flt._search_attr, _match)
+                return True
+
+        return False
+
+    if flt.lower:
+        _text = ctx.text_lower
+
+    return (
+        (flt._prefixes is None or flt._prefixes.starts(_text))
+        and (flt._suffixes is None or flt._suffixes.ends(_text))
+    )
+
+
+def _find_text_pattern(flt, message: MessageSnapshot) -> Optional[int]:
+    """Number of the first pattern matching the text (in a worker process)"""
+    if message.text is None:
+        return None
+
+    for number, find in enumerate(flt._regexes):
+        if find(message.text):
+            return number
+
+    return None
+
+
+def _set_text_match(flt, msg, number: Optional[int]) -> bool:
+    if number is None:
+        return False
+
+    setattr(msg, flt._search_attr, flt._regexes[number](get_context(msg).text))
+    return True
 
 
 def text(
@@ -214,8 +1446,18 @@ def text(
     lower: bool = True,
     re_match: Optional[Union[str, List[str]]] = None,
     re_search: Optional[Union[str, List[str]]] = None,
+    cpu_bound: bool = False,
 ):
-    """Filter on the message text/caption"""
+    """
+    Filter on the message text/caption
+
+    The first passed check is used: ``text`` (exact text), ``startswith``/``endswith`` (``lower`` - ignore case),
+    ``re_match`` (sets ``msg.match``), ``re_search`` (sets ``msg.search``).
+    All patterns are prepared once, here.
+
+    ``cpu_bound=True`` - search ``re_match``/``re_search`` patterns in the process pool (for many patterns
+    and long texts): the worker finds the first matching pattern, only it is run again here to set the match.
+    """
     if (
         not text
         and not startswith
@@ -225,85 +1467,37 @@ def text(
     ):
         raise ValueError("Please pass at least one argument in filter <hikka_filters.filters.text>")
     
-    async def check_text(flt, msg):
-        if flt.text:
-            return msg.text == flt.text if isinstance(flt.text, str) else msg.text in flt.text
-        elif flt.startswith and flt.endswith:
-            if isinstance(flt.startswith, str):
-                if isinstance(flt.endswith, str):
-                    return (
-                        msg.text.lower().startswith(flt.startswith.lower()) and msg.text.lower().endswith(flt.endswith.lower())
-                    ) if flt.lower else (
-                        msg.text.startswith(flt.startswith)
-                    )
-                else:
-                    for end in flt.endswith:
-                        if lower and msg.text.lower().startswith(flt.startswith.lower()) and msg.text.lower().endswith(end.lower()):
-                            return True
-                        elif msg.text.startswith(flt.startswith) and msg.text.endswith(end):
-                            return True
-            elif isinstance(flt.startswith, list):
-                for stwith in flt.startswith:
-                    if isinstance(flt.endswith, str):
-                        if lower and msg.text.lower().startswith(stwith.lower()) and msg.text.lower().endswith(flt.endswith.lower()):
-                            return True
-                        elif msg.text.startswith(stwith) and msg.text.endswith(flt.endswith):
-                            return True
-                    else:
-                        for end in flt.endswith:
-                            if lower and msg.text.lower().startswith(stwith.lower()) and msg.text.lower().endswith(end.lower()):
-                                return True
-                            elif msg.text.startswith(stwith) and msg.text.endswith(end):
-                                return True
-        elif flt.startswith:
-            if isinstance(flt.startswith, str):
-                return (
-                    msg.text.lower().startswith(flt.startswith.lower())
-                ) if flt.lower else (
-                    msg.text.startswith(flt.startswith)
-                )
-            elif isinstance(flt.startswith, list):
-                for stwith in flt.startswith:
-                    if lower and msg.text.lower().startswith(stwith.lower()) or msg.text.startswith(stwith):
-                        return True    
-        elif flt.endswith:
-            if isinstance(flt.endswith, str):
-                return (
-                    msg.text.lower().endswith(flt.endswith.lower())
-                ) if flt.lower else (
-                    msg.text.endswith(flt.endswith)
-                )
-            else:
-                for end in flt.endswith:
-                    if lower and msg.text.lower().endswith(end.lower()):
-                        return True
-                    elif msg.text.endswith(end):
-                        return True
-        elif flt.re_match:
-            if isinstance(flt.re_match, str):
-                if not (_match := re.match(flt.re_match, msg.text)):
-                    return False
-                msg.match = _match
-                return True
-            else:
-                for match in flt.re_match:
-                    if (_match := re.match(match, msg.text)):
-                        msg.match = _match
-                        return True
-        elif flt.re_search:
-            if isinstance(flt.re_search, str):
-                if not (_search := re.search(flt.re_search, msg.text)):
-                    return False
-                msg.search = _search
-                return True
-            else:
-                for search in flt.re_search:
-                    if (_search := re.search(search, msg.text)):
-                        msg.search = _search
-                        return True
-        
-        return False
+    text, startswith, endswith, re_match, re_search = map(_frozen, (text, startswith, endswith, re_match, re_search))
+    _exact = _prefixes = _suffixes = _regexes = _search_attr = None
+    if text:
+        _exact = frozenset(_as_tuple(text))
+    elif startswith or endswith:
+        _prepare = (lambda patterns: [p.lower() for p in _as_tuple(patterns)]) if lower else _as_tuple
+        _prefixes = _Affixes(_prepare(startswith)) if startswith else None
+        _suffixes = _Affixes(_prepare(endswith)) if endswith else None
+    else:
+        _search_attr = "match" if re_match else "search"
+        _regexes = tuple(
+            getattr(re.compile(pattern), _search_attr) for pattern in _as_tuple(re_match or re_search)
+        )
     
+    if cpu_bound and _regexes is not None:
+        return create_filter(
+            _find_text_pattern,
+            text=text,
+            startswith=startswith,
+            endswith=endswith,
+            lower=lower,
+            re_match=re_match,
+            re_search=re_search,
+            _regexes=_regexes,
+            _search_attr=_search_attr,
+            _finish=_set_text_match,
+            cpu_bound=True,
+            side_effects=True,
+            tier=TIER_RAW,
+        )
+
     return create_filter(
         check_text,
         text=text,
@@ -312,46 +1506,167 @@ def text(
         lower=lower,
         re_match=re_match,
         re_search=re_search,
+        _exact=_exact,
+        _prefixes=_prefixes,
+        _suffixes=_suffixes,
+        _regexes=_regexes,
+        _search_attr=_search_attr,
+        side_effects=_regexes is not None,
+        tier=TIER_RAW,
+        dispatch_key=(
+            ("prefix", frozenset(prefix[0].lower() for prefix in _prefixes.patterns))
+            if _prefixes is not None and not _prefixes.empty
+            else None
+        ),
+    )
+
+
+admin_cache = AsyncTTLCache(ttl=300, maxsize=10000, concurrency=8)
+"""Cache of ``chat_admin`` checks, keyed by ``(channel_id, user_id)`` (``admin_cache.configure(ttl=..., maxsize=...)``)"""
+
+
+admin_index = AdminIndex()
+"""Prefetched admin lists of supergroups, used by ``chat_admin_prefetched``"""
+
+
+async def _get_is_admin(client, channel_id: int, user_id: int) -> bool:
+    return (
+        await scheduler.call("get_permissions", (channel_id, user_id), lambda: client.get_permissions(channel_id, user_id))
+    ).is_admin
+
+
+async def cached_is_admin(client, channel_id: int, user_id: int) -> bool:
+    return await admin_cache.get(
+        (channel_id, user_id),
+        lambda: _get_is_admin(client, channel_id, user_id),
     )
 
 
 async def chat_admin_filter(flt, msg):
-    if msg.peer_id and isinstance(msg.peer_id, PeerChannel) and msg.chat.megagroup and (str(msg.sender_id).startswith('-100') is False):
-        return (await msg.client.get_permissions(msg.peer_id.channel_id, msg.sender_id)).is_admin
+    # supergroup (not a channel post), sender is a user
+    if isinstance(getattr(msg, "peer_id", None), PeerChannel) and not msg.post and _from_user(msg):
+        try:
+            return await flt.is_admin(msg.client, msg.peer_id.channel_id, msg.sender_id)
+        except RequestDeferred as e:
+            return scheduler.fails_open(e.method)
     else:
         return False
 
 
+def invalidate_chat_admin(chat_id: int, user_id: Optional[int] = None):
+    """
+    Drop cached ``chat_admin`` checks of a chat (or of one user in a chat).
+
+    Call it from a module on participant/admin-change updates.
+    """
+    if chat_id < -10 ** 12:
+        # marked ID: -100XXXXXXXXXX
+        chat_id = -chat_id - 10 ** 12
+
+    if user_id is None:
+        admin_cache.invalidate_where(lambda key: key[0] == chat_id)
+    else:
+        admin_cache.invalidate((chat_id, user_id))
+    
+    admin_index.invalidate(chat_id)
+
+
 async def premium_user_filter(flt, msg):
-    return msg.sender and isinstance(msg.sender, User) and msg.sender.premium
+    return _from_user(msg) and isinstance(msg.sender, User) and bool(msg.sender.premium)
 
 
 async def user_has_username_filter(flt, msg):
-    return msg.sender and isinstance(msg.sender, User) and bool(msg.sender.username)
+    return _from_user(msg) and isinstance(msg.sender, User) and bool(msg.sender.username)
 
 
 async def sender_bot_filter(flt, msg):
-    return msg.sender and isinstance(msg.sender, User) and bool(msg.sender.bot)
+    return _from_user(msg) and isinstance(msg.sender, User) and bool(msg.sender.bot)
+
+
+full_user_cache = AsyncTTLCache(ttl=600, maxsize=5000, concurrency=4)
+"""Cache of ``get_fulluser`` results (``full_user_cache.stats()`` - hits/misses)"""
+
+
+async def get_full_user(client, user_id: int):
+    """``client.get_fulluser(user_id)``, cached in ``full_user_cache``"""
+    return await full_user_cache.get(
+        user_id,
+        lambda: scheduler.call("get_fulluser", user_id, lambda: client.get_fulluser(user_id)),
+    )
 
 
 async def user_has_bio_filter(flt, msg):
-    return msg.sender and isinstance(msg.sender, User) and bool((await msg.client.get_fulluser(msg.sender.id)).full_user.about)
+    if not _from_user(msg):
+        return False
+
+    try:
+        return bool((await get_full_user(msg.client, msg.sender_id)).full_user.about)
+    except RequestDeferred as e:
+        return scheduler.fails_open(e.method)
 
 
 async def me_filter(flt, msg):
-    return msg.sender and isinstance(msg.sender, User) and bool(msg.sender.is_self)
+    # outgoing and sent by a user: by me, not as a channel (posts, send_as) or an anonymous admin
+    if getattr(msg, "out", False) and _from_user(msg):
+        return True
+
+    return _from_user(msg) and isinstance(msg.sender, User) and bool(msg.sender.is_self)
+
+
+def _reply_to_msg_id(msg) -> Optional[int]:
+    return getattr(getattr(msg, "reply_to", None), "reply_to_msg_id", None)
+
+
+async def get_reply_message(msg):
+    """
+    ``msg.get_reply_message()``, requested once per message:
+    filters and the handler body share one request (and its result)
+    """
+    if _reply_to_msg_id(msg) is None:
+        return None
+
+    try:
+        return await asyncio.shield(get_context(msg).reply_task)
+    except RequestDeferred:
+        return None
+
+
+@facet("reply_task")
+def _reply_task_facet(msg) -> asyncio.Future:
+    # replies to one message share the request
+    return asyncio.ensure_future(
+        scheduler.call("get_messages", (_peer_id(getattr(msg, "peer_id", None)), _reply_to_msg_id(msg)), msg.get_reply_message)
+    )
 
 
 async def reply_filter(flt, msg):
-    return bool((await msg.get_reply_message()))
+    if _reply_to_msg_id(msg) is None:
+        return False
+
+    try:
+        return bool(await asyncio.shield(get_context(msg).reply_task))
+    except RequestDeferred as e:
+        return scheduler.fails_open(e.method)
+
+
+async def reply_header_filter(flt, msg):
+    return _reply_to_msg_id(msg) is not None
+
+
+# messages in broadcast channels are marked as posts (``msg.post``), in supergroups - not:
+# the kind of a channel is known without ``msg.chat``
 
 
 async def group_chat_filter(flt, msg):
-    return hasattr(msg, "peer_id") and msg.peer_id and (isinstance(msg.peer_id, PeerChannel) and msg.chat.megagroup or isinstance(msg.peer_id, PeerChat))
+    return isinstance(peer := getattr(msg, "peer_id", None), PeerChat) or isinstance(peer, PeerChannel) and not msg.post
 
 
 async def channel_filter(flt, msg):
-    return msg.chat and msg.peer_id and (isinstance(msg.chat, Channel) and not msg.chat.megagroup and isinstance(msg.peer_id, PeerChannel))
+    return isinstance(getattr(msg, "peer_id", None), PeerChannel) and bool(msg.post)
+
+
+# the command and the whitespace after it: the same boundary as ``message.split(maxsplit=1)``
+_FIRST_WORD = re.compile(r"\s*\S+\s+")
 
 
 def get_args_raw(message) -> Union[str, bool]:
@@ -360,12 +1675,12 @@ def get_args_raw(message) -> Union[str, bool]:
     :param message: Message or string to get arguments from
     :return: Raw string of arguments
     
-    by utils from hikka
+    by utils from hikka (a slice after the first word, the text is not split)
     """
     if not (message := getattr(message, "message", message)):
         return False
     
-    return args[1] if len(args := message.split(maxsplit=1)) > 1 else ""
+    return message[m.end():] if (m := _FIRST_WORD.match(message)) else ""
 
 
 async def args_filter(flt, msg):
@@ -376,7 +1691,7 @@ async def args_filter(flt, msg):
 
 
 async def via_bot_filter(flt, msg):
-    return bool(msg.via_bot)
+    return getattr(msg, "via_bot_id", None) is not None
 
 
 async def media_filter(flt, msg):
@@ -384,40 +1699,48 @@ async def media_filter(flt, msg):
 
 
 
-chat_admin = create_filter(chat_admin_filter)
-"""Filter on the message sender user and user is a chat admin"""
+chat_admin = create_filter(chat_admin_filter, is_admin=staticmethod(cached_is_admin), cost=0.05, io_bound=True, tier=TIER_NETWORK)
+"""Filter on the message sender user and user is a chat admin (cached in ``admin_cache``)"""
+
+chat_admin_prefetched = create_filter(chat_admin_filter, is_admin=staticmethod(admin_index.is_admin), tier=TIER_NETWORK)
+"""Filter on the message sender user and user is a chat admin (by admin lists of chats, prefetched in ``admin_index``)"""
 
-premium_user = create_filter(premium_user_filter)
+premium_user = create_filter(premium_user_filter, tier=TIER_ENTITY)
 """Filter on the message sender user and user has premium"""
 
-user_has_username = create_filter(user_has_username_filter)
+user_has_username = create_filter(user_has_username_filter, tier=TIER_ENTITY)
 """Filter on the message sender user and user has username"""
 
-sender_bot = create_filter(sender_bot_filter)
+sender_bot = create_filter(sender_bot_filter, tier=TIER_ENTITY)
 """Filter on the message sender is a bot"""
 
-user_has_bio = create_filter(user_has_bio_filter)
-"""Filter on the message sender user and user has bio"""
+user_has_bio = create_filter(user_has_bio_filter, cost=0.1, io_bound=True, tier=TIER_NETWORK)
+"""Filter on the message sender user and user has bio (full users are cached in ``full_user_cache``)"""
 
-me = create_filter(me_filter)
+me = create_filter(me_filter, tier=TIER_ENTITY)
 """Filter on the message sender is self (`me`)"""
 
-reply = create_filter(reply_filter)
-"""Filter on the message, has reply message"""
+reply = create_filter(reply_filter, cost=0.05, io_bound=True, tier=TIER_NETWORK)
+"""Filter on the message, has reply message (fetched by ``get_reply_message``, use it in the handler too)"""
+
+reply_header = create_filter(reply_header_filter, tier=TIER_RAW)
+"""Filter on the message, is a reply (by the reply header only: no requests, the replied message may be deleted)"""
 
-group_chat = create_filter(group_chat_filter)
+group_chat = create_filter(group_chat_filter, tier=TIER_RAW)
 """Filter on the message, in a group and supergroup"""
 
-channel = create_filter(channel_filter)
+channel = create_filter(channel_filter, tier=TIER_RAW)
 """Filter on the message, in a channel"""
 
-args = create_filter(args_filter)
+args = create_filter(args_filter, side_effects=True, tier=TIER_RAW)
 """Filter on the message command, has arguments (get by ``from .. import utils; args = utils.get_args_raw(message)`` in a module for Hikka); if message has args: args = message.args"""
 
-via_bot = create_filter(via_bot_filter)
+_command_args = args  # ``args`` is shadowed by the parameter of ``command``
+
+via_bot = create_filter(via_bot_filter, tier=TIER_RAW)
 """Filter messages sent via inline bots"""
 
-media = create_filter(media_filter)
+media = create_filter(media_filter, tier=TIER_RAW)
 """Filter media messages.
 
 A media message contains any of the following fields set: *audio*, *document*, *photo*, *sticker*, *video*, *voice*, *video_note*, *dice*, *poll*.
@@ -438,7 +1761,7 @@ def command(filters: Optional[Filter] = None, args: Optional[Union[bool, Filter]
         _filters = filters
         if args:
             if isinstance(args, bool):
-                _args_flt = create_filter(args_filter)
+                _args_flt = _command_args
             else:
                 _args_flt = args
             
@@ -447,13 +1770,23 @@ def command(filters: Optional[Filter] = None, args: Optional[Union[bool, Filter]
             else:
                 _filters = _filters & _args_flt
         
+        if _filters:
+            _filters = compile_filter(_filters)
+        
+        name = cmd_func.__qualname__
+        
         async def func(_, update, *func_args, **func_kwargs):
-            if _filters and (await _filters(update, *func_args, **func_kwargs)) or not _filters:
+            if not _filters or (
+                await metrics.measure(name, _filters(update, *func_args, **func_kwargs))
+                if metrics.active
+                else await _filters(update, *func_args, **func_kwargs)
+            ):
                 return await cmd_func(_, update, *func_args, **func_kwargs)
             else:
                 return False
         
         func.__name__ = cmd_func.__name__
+        func.__qualname__ = name
         setattr(func, "is_command", True)
         for arg in args_:
             setattr(func, arg, True)
@@ -478,6 +1811,59 @@ CONTENT_TYPES = [
     "animation",
 ]
 
+# content types are bits of a mask, a probe reads only the fields needed for its type:
+# media types are never looked up for messages without media
+_CONTENT_PROBES = {
+    "photo": lambda message: (message.media is not None or message.action is not None) and message.photo is not None,
+    "text": lambda message: message.message is not None,
+    "video": lambda message: message.media is not None and message.video is not None,
+    "dice": lambda message: message.media is not None and message.dice is not None,
+    "forwarded": lambda message: message.fwd_from is not None,
+    "audio": lambda message: message.media is not None and message.audio is not None,
+    "document": lambda message: message.media is not None and message.document is not None,
+    "sticker": lambda message: message.media is not None and message.sticker is not None,
+    "via_bot": lambda message: message.via_bot_id is not None,
+    "animation": lambda message: message.media is not None and message.gif is not None,
+}
+_CONTENT_TYPE_BITS = {_type: 1 << number for number, _type in enumerate(CONTENT_TYPES)}
+_ALL_CONTENT_TYPES = (1 << len(CONTENT_TYPES)) - 1
+
+
+@facet("content_bits")
+def _content_bits_facet(message) -> list:
+    """``[known, present]``: masks of content types checked for the update and of present ones"""
+    return [0, 0]
+
+
+def _content_type_bits(message, mask: int = _ALL_CONTENT_TYPES) -> int:
+    """Mask of the present content types of ``mask`` (types are checked once per update)"""
+    bits = get_context(message).content_bits
+    if missing := mask & ~bits[0]:
+        for _type, bit in _CONTENT_TYPE_BITS.items():
+            if missing & bit and _CONTENT_PROBES[_type](message):
+                bits[1] |= bit
+
+        bits[0] |= missing
+
+    return bits[1] & mask
+
+
+async def check_content_types(flt, message):
+    bits = get_context(message).content_bits
+    if bits[1] & flt._mask:
+        return True
+
+    # types, not checked for the update yet, until the first present one
+    for bit, probe in flt._probes:
+        if not bits[0] & bit:
+            bits[0] |= bit
+            if probe(message):
+                bits[1] |= bit
+                return True
+
+    return False
+
+
 def content_types(types: Union[List[str], str]):
     """Check message with content-types
     Parameters:
@@ -496,26 +1882,6 @@ def content_types(types: Union[List[str], str]):
         ``animation``
     """
     
-    async def check_content_types(flt, message):
-        _types = {
-            "photo": (message.photo is not None),
-            "text": (message.text is not None),
-            "video": (message.video is not None),
-            "dice": (message.dice is not None),
-            "forwarded": (message.fwd_from is not None),
-            "audio": (message.audio is not None),
-            "document": (message.document is not None),
-            "sticker": (message.sticker is not None),
-            "via_bot": (message.via_bot is not None),
-            "animation": (message.gif is not None),
-        }
-        
-        for _type in flt.types:
-            if _types[_type]:
-                return True
-        
-        return False
-    
     if isinstance(types, str):
         types = [types]
     
@@ -523,7 +1889,14 @@ def content_types(types: Union[List[str], str]):
         if _type not in CONTENT_TYPES:
             raise ValueError(f"Type, passed in filter <content_types>: \"{_type}\" not is a content type!")
     
-    return create_filter(check_content_types, types=types)
+    return create_filter(
+        check_content_types,
+        types=tuple(types),
+        _mask=functools.reduce(int.__or__, (_CONTENT_TYPE_BITS[_type] for _type in types), 0),
+        _probes=tuple((_CONTENT_TYPE_BITS[_type], _CONTENT_PROBES[_type]) for _type in dict.fromkeys(types)),
+        dispatch_key=("content", frozenset(types)),
+        tier=TIER_RAW,
+    )
 
 CHAT_TYPES = [
     "PRIVATE",
@@ -532,6 +1905,35 @@ CHAT_TYPES = [
     "SUPERGROUP",
 ]
 
+_CHAT_TYPE_BITS = {_type: 1 << number for number, _type in enumerate(CHAT_TYPES)}
+_CHAT_TYPE_NAMES = {bit: _type for _type, bit in _CHAT_TYPE_BITS.items()}
+
+
+@facet("chat_type_bit")
+def _chat_type_bit_facet(message) -> int:
+    """Bit of the chat type (``0`` - unknown)"""
+    peer = getattr(message, "peer_id", None)
+    if isinstance(peer, PeerUser):
+        return _CHAT_TYPE_BITS["PRIVATE"]
+    
+    if isinstance(peer, PeerChat):
+        return _CHAT_TYPE_BITS["GROUP"]
+    
+    if isinstance(peer, PeerChannel):
+        return _CHAT_TYPE_BITS["CHANNEL" if message.post else "SUPERGROUP"]
+    
+    return 0
+
+
+@facet("chat_type")
+def _chat_type_facet(message) -> Optional[str]:
+    return _CHAT_TYPE_NAMES.get(get_context(message).chat_type_bit)
+
+
+async def check_chat_type(flt, message):
+    return bool(get_context(message).chat_type_bit & flt._mask)
+
+
 def chat_type(types: Union[List[str], str]):
     """Check chat with chat-type
     Parameters:
@@ -544,39 +1946,6 @@ def chat_type(types: Union[List[str], str]):
         ``SUPERGROUP``
     """
     
-    async def check_chat_type(flt, message):
-        if (
-            not hasattr(message, "peer_id")
-            or not message.peer_id
-            or not hasattr(message, "chat")
-            or not message.chat
-        ):
-            return False
-        
-        _types = {
-            "PRIVATE": isinstance(message.peer_id, PeerUser),
-            "CHANNEL": (
-                hasattr(message, "chat")
-                and message.chat
-                and isinstance(message.chat, Channel)
-                and not message.chat.megagroup
-                and isinstance(message.peer_id, PeerChannel)
-            ),
-            "GROUP": isinstance(message.peer_id, PeerChat),
-            "SUPERGROUP": (
-                hasattr(message, "chat")
-                and message.chat
-                and isinstance(message.peer_id, PeerChannel)
-                and message.chat.megagroup
-            ),
-        }
-        
-        for _type in flt.types:
-            if _types[_type.upper()]:
-                return True
-        
-        return False
-    
     if isinstance(types, str):
         types = [types]
     
@@ -584,11 +1953,39 @@ def chat_type(types: Union[List[str], str]):
         if _type.upper() not in CHAT_TYPES:
             raise ValueError(f"Type, passed in filter <content_types>: \"{_type}\" not is a chat type!")
     
-    return create_filter(check_chat_type, types=types)
+    _types = frozenset(_type.upper() for _type in types)
+    return create_filter(
+        check_chat_type,
+        types=tuple(types),
+        _types=_types,
+        _mask=functools.reduce(int.__or__, (_CHAT_TYPE_BITS[_type] for _type in _types), 0),
+        dispatch_key=("chat_type", _types),
+        tier=TIER_RAW,
+    )
 
 
 __all__ = [
     "create_filter",
+    "compile_filter",
+    "concurrently",
+    "TIER_RAW",
+    "TIER_ENTITY",
+    "TIER_NETWORK",
+    "set_blocking_executor",
+    "PeerSet",
+    "AsyncTTLCache",
+    "admin_cache",
+    "AdminIndex",
+    "admin_index",
+    "username_index",
+    "throttle",
+    "TokenBuckets",
+    "SketchBuckets",
+    "UsernameIndex",
+    "chat_admin_prefetched",
+    "full_user_cache",
+    "get_full_user",
+    "invalidate_chat_admin",
     "user",
     "chat_admin",
     "premium_user",
@@ -597,6 +1994,8 @@ __all__ = [
     "user_has_bio",
     "me",
     "reply",
+    "reply_header",
+    "get_reply_message",
     "group_chat",
     "channel",
     "args",
@@ -607,5 +2006,17 @@ __all__ = [
     "text",
     "content_types",
     "command",
-    "chat_type"
+    "chat_type",
+    "EvaluationContext",
+    "get_context",
+    "facet",
+    "FilterMetrics",
+    "metrics",
+    "Tracer",
+    "tracer",
+    "RequestDeferred",
+    "RequestScheduler",
+    "scheduler",
+    "MessageSnapshot",
+    "set_process_pool",
 ]
\ No newline at end of file
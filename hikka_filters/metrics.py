@@ -0,0 +1,228 @@
+import bisect
+import contextvars
+import time
+import weakref
+from typing import Awaitable, Optional
+
+BUCKETS = (
+    1e-6, 2.5e-6, 5e-6,
+    1e-5, 2.5e-5, 5e-5,
+    1e-4, 2.5e-4, 5e-4,
+    1e-3, 2.5e-3, 5e-3,
+    1e-2, 2.5e-2, 5e-2,
+    0.1, 0.25, 0.5,
+    1.0, 2.5, 5.0, 10.0,
+)
+"""Upper bounds (seconds) of latency histogram buckets, the last bucket is for slower checks"""
+
+# create_filter kwargs which are hints for plans, not parameters of the filter
+_HINTS = {"blocking", "side_effects", "cost", "tier", "io_bound", "dispatch_key", "dynamic"}
+_PARAM_TYPES = (str, int, float, bool, list, tuple, set, frozenset)
+
+
+class Stat:
+    """Counters of one filter or handler"""
+    __slots__ = ("calls", "passed", "seconds", "histogram", "offloads", "requests")
+
+    def __init__(self):
+        self.calls = 0
+        self.passed = 0
+        self.seconds = 0.0
+        self.histogram = [0] * (len(BUCKETS) + 1)
+        self.offloads = 0  # checks run in the executor
+        self.requests = 0  # network requests made by checks
+
+    def record(self, result, seconds: float):
+        self.calls += 1
+        self.passed += bool(result)
+        self.seconds += seconds
+        self.histogram[bisect.bisect_left(BUCKETS, seconds)] += 1
+
+    def quantile(self, q: float) -> Optional[float]:
+        """Estimate (upper bound of the bucket) of a latency quantile, seconds"""
+        if not self.calls:
+            return None
+
+        rank = q * self.calls
+        seen = 0
+        for bucket, count in enumerate(self.histogram):
+            seen += count
+            if seen >= rank and count:
+                return BUCKETS[bucket] if bucket < len(BUCKETS) else float("inf")
+
+        return None
+
+    def as_dict(self) -> dict:
+        return {
+            "calls": self.calls,
+            "passed": self.passed,
+            "failed": self.calls - self.passed,
+            "seconds": self.seconds,
+            "mean": self.seconds / self.calls if self.calls else None,
+            "p50": self.quantile(0.5),
+            "p99": self.quantile(0.99),
+            "histogram": [
+                [BUCKETS[bucket] if bucket < len(BUCKETS) else None, count]
+                for bucket, count in enumerate(self.histogram)
+                if count
+            ],
+            "offloads": self.offloads,
+            "requests": self.requests,
+        }
+
+
+def filter_params(flt) -> dict:
+    """Kwargs of a ``create_filter`` filter (class attributes of other ``Filter`` subclasses)"""
+    if (names := getattr(type(flt), "_params", None)) is not None:
+        return {name: getattr(flt, name) for name in names}
+
+    return dict(vars(type(flt)))
+
+
+def describe(flt) -> str:
+    """Readable name of a filter: its name in ``hikka_filters.filters`` or function and parameters"""
+    from . import filters
+
+    for name, value in vars(filters).items():
+        if value is flt and not name.startswith("_"):
+            return name
+
+    params = ", ".join(
+        f"{key}={value!r:.40}"
+        for key, value in filter_params(flt).items()
+        if not key.startswith("_") and key not in _HINTS and value is not None and isinstance(value, _PARAM_TYPES)
+    )
+    return f"{getattr(getattr(flt, '_func', None), '__name__', type(flt).__name__)}({params})"
+
+
+class FilterMetrics:
+    """
+    Optional instrumentation of filters and handlers (``hikka_filters.metrics``)
+
+    Disabled by default: then a check costs one ``metrics.active`` lookup
+    (``active`` - stats are collected or updates are traced, see ``hikka_filters.tracing``).
+    Enabled (``metrics.enable()``), plans record calls, passes, time and a latency histogram
+    of every filter, executor offloads and network requests made by its checks;
+    ``check_filters``/``command``/``Router`` handlers record the same for the whole check.
+    """
+    def __init__(self):
+        self.enabled = False
+        self.tracing = False
+        self.active = False
+        self.filters = weakref.WeakKeyDictionary()  # filter -> Stat
+        self.handlers = {}  # handler name -> Stat
+        self.requests = 0  # all requests, made by filters or not
+        self.started = time.time()
+        self.current = contextvars.ContextVar("hikka_filters_current_filter", default=None)
+        self.handler = contextvars.ContextVar("hikka_filters_current_handler", default=None)
+        self.trace = contextvars.ContextVar("hikka_filters_current_trace", default=None)
+
+    def enable(self):
+        self.enabled = self.active = True
+
+    def disable(self):
+        self.enabled = False
+        self.active = self.tracing
+
+    def reset(self):
+        self.filters.clear()
+        self.handlers.clear()
+        self.requests = 0
+        self.started = time.time()
+
+    def _stat(self, flt) -> Stat:
+        try:
+            if (stat := self.filters.get(flt)) is None:
+                stat = self.filters[flt] = Stat()
+        except TypeError:
+            # no weakrefs support
+            return Stat()
+
+        return stat
+
+    def record(self, flt, result, seconds: float, offloaded: bool = False):
+        """Record a check of ``flt``"""
+        stat = self._stat(flt)
+        stat.record(result, seconds)
+        stat.offloads += offloaded
+
+    def request(self, method: str):
+        """Count a network request (attributed to the filter being checked)"""
+        if not self.active:
+            return
+
+        flt = self.current.get()
+        if self.enabled:
+            self.requests += 1
+            if flt is not None:
+                self._stat(flt).requests += 1
+
+        if (trace := self.trace.get()) is not None:
+            trace.request(flt, method)
+
+    async def measure(self, name: str, check: Awaitable) -> bool:
+        """Await the filters check of handler ``name`` and record it"""
+        token = self.handler.set(name)
+        started = time.perf_counter()
+        try:
+            result = await check
+        finally:
+            self.handler.reset(token)
+
+        if self.enabled:
+            if (stat := self.handlers.get(name)) is None:
+                stat = self.handlers[name] = Stat()
+
+            stat.record(result, time.perf_counter() - started)
+
+        return result
+
+    def snapshot(self) -> dict:
+        """Copy of all counters (JSON-serializable, except ``inf`` quantiles of the slowest bucket)"""
+        filters = {}
+        for flt, stat in list(self.filters.items()):
+            name = describe(flt)
+            number = 1
+            while (key := name if number == 1 else f"{name} #{number}") in filters:
+                number += 1
+
+            filters[key] = stat.as_dict()
+
+        return {
+            "enabled": self.enabled,
+            "since": self.started,
+            "requests": self.requests,
+            "filters": filters,
+            "handlers": {name: stat.as_dict() for name, stat in self.handlers.items()},
+        }
+
+    def format(self, limit: int = 15) -> str:
+        """Text table of the slowest filters and handlers (for a ``.filterstats`` command)"""
+        snapshot = self.snapshot()
+        lines = [f"requests: {snapshot['requests']}, for {time.time() - snapshot['since']:.0f}s"]
+        for title, stats in (("handlers", snapshot["handlers"]), ("filters", snapshot["filters"])):
+            lines.append(f"{title}:")
+            for name, stat in sorted(stats.items(), key=lambda item: -item[1]["seconds"])[:limit]:
+                lines.append(
+                    f"  {name}: {stat['calls']} calls, {stat['passed'] / stat['calls']:.0%} passed, "
+                    f"{_ms(stat['mean'])} mean, {_bound_ms(stat['p99'])} p99, {stat['seconds']:.2f}s total"
+                    + (f", {stat['offloads']} offloads" if stat["offloads"] else "")
+                    + (f", {stat['requests']} requests" if stat["requests"] else "")
+                )
+
+        return "\n".join(lines)
+
+
+def _ms(seconds: Optional[float]) -> str:
+    return "-" if seconds is None else f"{seconds * 1000:.3f}ms"
+
+
+def _bound_ms(seconds: Optional[float]) -> str:
+    if seconds is None:
+        return "-"
+
+    return f">{BUCKETS[-1] * 1000:g}ms" if seconds == float("inf") else f"<={seconds * 1000:g}ms"
+
+
+metrics = FilterMetrics()
+"""Instrumentation of all filters (``metrics.enable()``, ``metrics.snapshot()``, ``metrics.format()``)"""
@@ -0,0 +1,187 @@
+import asyncio
+import collections
+import itertools
+import logging
+import pickle
+import types
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, NamedTuple, Optional
+
+from .context import get_context
+from .metrics import filter_params
+
+logger = logging.getLogger(__name__)
+
+
+class MessageSnapshot(NamedTuple):
+    """Picklable fields of a message, passed to ``cpu_bound`` filters instead of the message"""
+    id: Optional[int]
+    chat_id: Optional[int]
+    sender_id: Optional[int]
+    text: Optional[str]
+    out: bool
+    post: bool
+    media: bool
+    forwarded: bool
+    via_bot_id: Optional[int]
+    reply_to_msg_id: Optional[int]
+
+
+def snapshot(msg) -> MessageSnapshot:
+    peer = getattr(msg, "peer_id", None)
+    return MessageSnapshot(
+        id=getattr(msg, "id", None),
+        chat_id=getattr(peer, "channel_id", None) or getattr(peer, "chat_id", None) or getattr(peer, "user_id", None),
+        sender_id=getattr(msg, "sender_id", None),
+        text=get_context(msg).text,
+        out=bool(getattr(msg, "out", False)),
+        post=bool(getattr(msg, "post", False)),
+        media=getattr(msg, "media", None) is not None,
+        forwarded=getattr(msg, "fwd_from", None) is not None,
+        via_bot_id=getattr(msg, "via_bot_id", None),
+        reply_to_msg_id=getattr(getattr(msg, "reply_to", None), "reply_to_msg_id", None),
+    )
+
+
+# filter specs: a worker gets the spec of a filter with its first check there
+_specs = weakref.WeakKeyDictionary()  # filter -> (spec id, pickled (func, params)) or None - runs inline
+_spec_counter = itertools.count()
+_WORKER_SPECS = 1024  # specs cached by a worker, the least recently used are dropped
+
+_pool: Optional[ProcessPoolExecutor] = None
+_workers = 2
+_max_pending = 4
+_pending = 0
+_inline_runs = 0  # the pool was saturated or broken
+_spec_sends = 0  # specs sent to workers
+
+
+def set_process_pool(max_workers: int = 2, max_pending: Optional[int] = None):
+    """
+    Set the size of the process pool for sync filters marked as ``cpu_bound``.
+
+    Above ``max_pending`` (default: ``2 * max_workers``) checks in flight, new ones run inline, in the event loop.
+    """
+    global _pool, _workers, _max_pending
+    if _pool is not None:
+        _pool.shutdown(wait=False)
+
+    _pool = None
+    _workers = max_workers
+    _max_pending = 2 * max_workers if max_pending is None else max_pending
+
+
+def stats() -> dict:
+    """Specs of live ``cpu_bound`` filters, specs sent to workers, checks in flight and checks run inline"""
+    return {
+        "specs": sum(spec is not None for spec in list(_specs.values())),
+        "spec_sends": _spec_sends,
+        "workers": _workers,
+        "pending": _pending,
+        "inline_runs": _inline_runs,
+    }
+
+
+def _predicate(flt):
+    """``func(flt, update)`` of the filter"""
+    return flt._func if hasattr(flt, "_func") else type(flt).__call__
+
+
+def _params(flt) -> dict:
+    params = {}
+    for name, value in filter_params(flt).items():
+        if name.startswith("__") or name in ("_snapshot", "_finish"):
+            continue
+
+        try:
+            pickle.dumps(value)
+        except Exception:
+            continue
+
+        params[name] = value
+
+    return params
+
+
+def register(flt) -> Optional[int]:
+    """Make a worker spec of a ``cpu_bound`` filter (done when plans are compiled)"""
+    try:
+        spec = _specs[flt]
+    except KeyError:
+        func = _predicate(flt)
+        try:
+            spec = next(_spec_counter), pickle.dumps((func, _params(flt)))
+        except Exception:
+            logger.warning("cpu_bound filter %s is not picklable (not a module-level function?), runs inline", func)
+            spec = None
+
+        _specs[flt] = spec
+
+    return spec[0] if spec is not None else None
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(_workers)
+
+    return _pool
+
+
+_worker_filters = collections.OrderedDict()  # in workers: spec id -> (func, parameters as attributes)
+
+
+class _MissingSpec:
+    """Result of a worker which does not know the spec yet (the check is sent again with it)"""
+
+
+def _run_in_worker(spec_id: int, message: MessageSnapshot, spec: Optional[bytes] = None) -> Any:
+    if (entry := _worker_filters.get(spec_id)) is None:
+        if spec is None:
+            return _MissingSpec()
+
+        func, params = pickle.loads(spec)
+        entry = _worker_filters[spec_id] = (func, types.SimpleNamespace(**params))
+        while len(_worker_filters) > _WORKER_SPECS:
+            _worker_filters.popitem(last=False)
+    else:
+        _worker_filters.move_to_end(spec_id)
+
+    func, flt = entry
+    return func(flt, message)
+
+
+async def run_cpu_bound(flt, msg) -> bool:
+    """
+    Check ``msg`` with a ``cpu_bound`` filter in the process pool
+
+    The filter gets a ``MessageSnapshot`` (or ``flt._snapshot(msg)``), its result goes through
+    ``flt._finish(msg, result)`` if the filter has it (in this process, e.g. to set fields of the message).
+    """
+    global _pending, _inline_runs, _spec_sends
+    message = flt._snapshot(msg) if hasattr(flt, "_snapshot") else snapshot(msg)
+    spec_id = register(flt)
+    result = None
+    if spec_id is not None and _pending < _max_pending:
+        _pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            result = await loop.run_in_executor(_get_pool(), _run_in_worker, spec_id, message)
+            if isinstance(result, _MissingSpec):
+                _spec_sends += 1
+                result = await loop.run_in_executor(_get_pool(), _run_in_worker, spec_id, message, _specs[flt][1])
+        except BrokenProcessPool:
+            set_process_pool(_workers, _max_pending)
+            spec_id = None
+        finally:
+            _pending -= 1
+    else:
+        spec_id = None
+
+    if spec_id is None:
+        _inline_runs += 1
+        result = _predicate(flt)(flt, message)
+
+    return flt._finish(msg, result) if hasattr(flt, "_finish") else bool(result)
@@ -0,0 +1,201 @@
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional
+
+from hikkatl.errors import FloodWaitError
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+FALLBACKS = ("cache", "open", "closed")
+
+
+class RequestDeferred(Exception):
+    """The request was not made: its method is backing off after a flood wait"""
+    def __init__(self, method: str, seconds: float):
+        super().__init__(f"{method} is backing off for {seconds:.0f}s after a flood wait")
+        self.method = method
+        self.seconds = seconds
+
+
+class RequestScheduler:
+    """
+    Shared gate for Telegram API requests of network filters
+
+    Requests are limited to ``concurrency`` in flight (and ``method_concurrency[method]`` per method)
+    and to ``rate`` per second (token bucket of ``burst`` tokens). Identical pending requests
+    (same method and key) are made once.
+
+    On ``FloodWaitError`` the method backs off for the requested seconds. Meanwhile its requests are
+    not made and filters answer by ``fallback`` (``method_fallback[method]`` overrides it):
+    ``"cache"`` - the last result of the same request (if there is none - as ``"closed"``),
+    ``"open"`` - the filter passes, ``"closed"`` - the filter does not pass.
+
+    Set ``client.flood_sleep_threshold = 0``, otherwise the client sleeps through short flood waits itself.
+    """
+    def __init__(
+        self,
+        concurrency: int = 8,
+        method_concurrency: Optional[Dict[str, int]] = None,
+        rate: float = 20.0,
+        burst: int = 20,
+        fallback: str = "cache",
+        method_fallback: Optional[Dict[str, str]] = None,
+        maxresults: int = 10000,
+    ):
+        self.concurrency = concurrency
+        self.method_concurrency = dict(method_concurrency or {})
+        self.rate = rate
+        self.burst = burst
+        self.fallback = fallback
+        self.method_fallback = dict(method_fallback or {})
+        self.maxresults = maxresults
+        self.requests = 0
+        self.deduplicated = 0
+        self.deferred = 0
+        self.flood_waits = 0
+        self._check_fallbacks()
+        self._tokens = float(burst)
+        self._updated = time.monotonic()
+        self._semaphore = None
+        self._semaphores = {}  # method -> asyncio.Semaphore
+        self._pending = {}  # (method, key) -> asyncio.Task
+        self._blocked = {}  # method -> monotonic time of the end of the backoff
+        self._results = OrderedDict()  # (method, key) -> last result
+
+    def _check_fallbacks(self):
+        for fallback in (self.fallback, *self.method_fallback.values()):
+            if fallback not in FALLBACKS:
+                raise ValueError(f"Fallback must be one of {FALLBACKS}, not {fallback!r}")
+
+    def configure(self, **kwargs):
+        """Change the limits/fallbacks (``concurrency=..., rate=..., fallback=...``), pending requests are kept"""
+        for name, value in kwargs.items():
+            if not hasattr(self, name) or name.startswith("_"):
+                raise TypeError(f"Unknown option: {name}")
+
+            setattr(self, name, value)
+
+        self._check_fallbacks()
+        # new requests get new semaphores, requests in flight release the ones they hold
+        self._semaphore = None
+        self._semaphores = {}
+        self._tokens = min(self._tokens, float(self.burst))
+
+    def backoff(self, method: str) -> float:
+        """Seconds left of the backoff of ``method`` (``0`` - requests are made)"""
+        if (until := self._blocked.get(method)) is None:
+            return 0.0
+
+        if (left := until - time.monotonic()) <= 0:
+            del self._blocked[method]
+            return 0.0
+
+        return left
+
+    def fails_open(self, method: str) -> bool:
+        """Filter result for a deferred request of ``method``"""
+        return self.method_fallback.get(method, self.fallback) == "open"
+
+    async def call(self, method: str, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Make the request ``fetch()`` (``method`` and ``key`` identify it)
+
+        Raises ``RequestDeferred`` if the method is backing off and there is no result for the fallback.
+        """
+        if left := self.backoff(method):
+            return self._fall_back(method, key, left)
+
+        if (task := self._pending.get(request := (method, key))) is None:
+            task = self._pending[request] = asyncio.ensure_future(self._run(method, key, fetch))
+        else:
+            self.deduplicated += 1
+
+        return await asyncio.shield(task)
+
+    def _fall_back(self, method: str, key: Hashable, seconds: float) -> Any:
+        self.deferred += 1
+        if self.method_fallback.get(method, self.fallback) == "cache" and (method, key) in self._results:
+            return self._results[(method, key)]
+
+        raise RequestDeferred(method, seconds)
+
+    async def _run(self, method: str, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        try:
+            if (semaphore := self._semaphores.get(method)) is None and method in self.method_concurrency:
+                semaphore = self._semaphores[method] = asyncio.Semaphore(self.method_concurrency[method])
+
+            if semaphore is None:
+                return await self._run_global(method, key, fetch)
+
+            # requests waiting for their method's limit do not hold global slots
+            async with semaphore:
+                return await self._run_global(method, key, fetch)
+        finally:
+            self._pending.pop((method, key), None)
+
+    async def _run_global(self, method: str, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        if (semaphore := self._semaphore) is None:
+            semaphore = self._semaphore = asyncio.Semaphore(self.concurrency)
+
+        async with semaphore:
+            return await self._request(method, key, fetch)
+
+    async def _request(self, method: str, key: Hashable, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        await self._take_token()
+        # another request could get a flood wait while this one was queued
+        if left := self.backoff(method):
+            return self._fall_back(method, key, left)
+
+        self.requests += 1
+        metrics.request(method)
+        try:
+            result = await fetch()
+        except FloodWaitError as e:
+            self.flood_waits += 1
+            self._blocked[method] = max(self._blocked.get(method, 0), time.monotonic() + e.seconds)
+            logger.warning("Flood wait of %ss on %s, answering by fallback meanwhile", e.seconds, method)
+            return self._fall_back(method, key, e.seconds)
+
+        self._remember(method, key, result)
+        return result
+
+    def _remember(self, method: str, key: Hashable, result: Any):
+        self._results[(method, key)] = result
+        self._results.move_to_end((method, key))
+        while len(self._results) > self.maxresults:
+            self._results.popitem(last=False)
+
+    async def _take_token(self):
+        while True:
+            now = time.monotonic()
+            self._tokens = min(float(self.burst), self._tokens + (now - self._updated) * self.rate)
+            self._updated = now
+            if self._tokens >= 1:
+                self._tokens -= 1
+                return
+
+            await asyncio.sleep((1 - self._tokens) / self.rate)
+
+    def stats(self) -> dict:
+        """Requests made, deduplicated, answered by fallback, flood waits and methods backing off"""
+        return {
+            "requests": self.requests,
+            "deduplicated": self.deduplicated,
+            "deferred": self.deferred,
+            "flood_waits": self.flood_waits,
+            "pending": len(self._pending),
+            "backoff": {method: left for method in list(self._blocked) if (left := self.backoff(method))},
+        }
+
+    def clear(self):
+        """Forget last results and backoffs (pending requests are not cancelled)"""
+        self._blocked.clear()
+        self._results.clear()
+
+
+scheduler = RequestScheduler()
+"""Scheduler of requests of the built-in network filters (``scheduler.configure(...)``, ``scheduler.stats()``)"""
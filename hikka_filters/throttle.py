@@ -0,0 +1,124 @@
+import array
+import random
+from typing import Hashable
+
+MODES = ("lru", "sketch")
+
+
+class TokenBuckets:
+    """
+    Token buckets of at most ``maxkeys`` keys (``rate`` tokens per second, up to ``burst``)
+
+    Buckets live in preallocated arrays, a key only maps to its slot: no object per key.
+    When all slots are used, a not recently used key is evicted (CLOCK, an approximate LRU)
+    and gets a full bucket when it comes back.
+    """
+    def __init__(self, rate: float, burst: float, maxkeys: int = 100000):
+        if burst < 1:
+            raise ValueError(f"Burst must be at least 1 (a take needs a whole token), not {burst!r}")
+
+        self.rate = rate
+        self.burst = burst
+        self.maxkeys = maxkeys
+        self.evictions = 0
+        self._slots = {}  # key -> slot
+        self._keys = [None] * maxkeys
+        self._tokens = array.array("d", bytes(8 * maxkeys))
+        self._updated = array.array("d", bytes(8 * maxkeys))
+        self._referenced = bytearray(maxkeys)
+        self._hand = 0
+
+    def _evict(self) -> int:
+        referenced = self._referenced
+        while referenced[self._hand]:
+            referenced[self._hand] = 0
+            self._hand = (self._hand + 1) % self.maxkeys
+
+        slot = self._hand
+        self._hand = (slot + 1) % self.maxkeys
+        del self._slots[self._keys[slot]]
+        self.evictions += 1
+        return slot
+
+    def take(self, key: Hashable, now: float) -> bool:
+        """Take a token of ``key`` (``False`` - the bucket is empty)"""
+        if (slot := self._slots.get(key)) is None:
+            slot = self._evict() if len(self._slots) >= self.maxkeys else len(self._slots)
+            self._slots[key] = slot
+            self._keys[slot] = key
+            tokens = self.burst
+        else:
+            tokens = min(self.burst, self._tokens[slot] + (now - self._updated[slot]) * self.rate)
+
+        self._referenced[slot] = 1
+        self._updated[slot] = now
+        if tokens >= 1:
+            self._tokens[slot] = tokens - 1
+            return True
+
+        self._tokens[slot] = tokens
+        return False
+
+    def clear(self):
+        self._slots.clear()
+        self._keys = [None] * self.maxkeys
+        self._referenced = bytearray(self.maxkeys)
+        self._hand = 0
+
+    def __len__(self):
+        return len(self._slots)
+
+
+class SketchBuckets:
+    """
+    Approximate token buckets of any number of keys in ``width * depth`` cells (a count-min sketch)
+
+    A cell keeps the level of a leaky bucket (tokens taken, leaking ``rate`` per second),
+    the level of a key is the minimum over its ``depth`` cells. Keys sharing all cells with
+    heavy ones may be throttled too (rarely, with enough ``width``); nothing is evicted.
+    """
+    _PRIME = (1 << 61) - 1
+
+    def __init__(self, rate: float, burst: float, width: int = 65536, depth: int = 4):
+        if burst < 1:
+            raise ValueError(f"Burst must be at least 1 (a take needs a whole token), not {burst!r}")
+
+        self.rate = rate
+        self.burst = burst
+        self.width = width
+        self.depth = depth
+        rng = random.Random(width * depth)
+        self._hashes = [(rng.randrange(1, self._PRIME), rng.randrange(self._PRIME)) for _ in range(depth)]
+        self._levels = array.array("d", bytes(8 * width * depth))
+        self._updated = array.array("d", bytes(8 * width * depth))
+
+    def take(self, key: Hashable, now: float) -> bool:
+        """Take a token of ``key`` (``False`` - its buckets are full)"""
+        h = hash(key)
+        width = self.width
+        levels = self._levels
+        updated = self._updated
+        cells = [
+            row * width + (a * h + b) % self._PRIME % width
+            for row, (a, b) in enumerate(self._hashes)
+        ]
+        for cell in cells:
+            levels[cell] = max(0.0, levels[cell] - (now - updated[cell]) * self.rate)
+            updated[cell] = now
+
+        if (level := min(levels[cell] for cell in cells) + 1) > self.burst:
+            return False
+
+        # conservative update: only the cells below the new level of the key are raised
+        for cell in cells:
+            if levels[cell] < level:
+                levels[cell] = level
+
+        return True
+
+    def clear(self):
+        self._levels = array.array("d", bytes(8 * self.width * self.depth))
+        self._updated = array.array("d", bytes(8 * self.width * self.depth))
+
+    def __len__(self):
+        return self.width * self.depth
@@ -0,0 +1,101 @@
+import collections
+import json
+from typing import Any, Callable, Optional
+
+from .context import facet
+from .metrics import describe, metrics
+
+
+class Trace:
+    """Filter checks of one traced plan call"""
+    def __init__(self):
+        self.order = []  # steps in execution order
+        self._steps = {}  # id(filter) -> deque of its steps
+        self._io = {}  # id(filter) -> requests made by its running check
+
+    def request(self, flt, method: str):
+        self._io.setdefault(id(flt), []).append(method)
+
+    def record(self, flt, result, seconds: float, offloaded: bool = False):
+        step = {
+            "filter": describe(flt),
+            "ran": True,
+            "result": bool(result),
+            "seconds": seconds,
+            "offloaded": offloaded,
+            "io": self._io.pop(id(flt), []),
+        }
+        self.order.append(step)
+        self._steps.setdefault(id(flt), collections.deque()).append(step)
+
+    def pop(self, flt) -> Optional[dict]:
+        """The next recorded step of ``flt`` (``None`` - it did not run)"""
+        return steps.popleft() if (steps := self._steps.get(id(flt))) else None
+
+
+class Tracer:
+    """
+    Sampled traces of filter checks (``hikka_filters.tracing``)
+
+    Every ``every``-th update (and updates matching ``predicate(update)``) is traced by all plans
+    checking it: the tree of the plan with the result and time of each node, skipped (short-circuited)
+    nodes and the requests each filter made. The last ``maxlen`` traces are kept in ``tracer.traces``.
+
+        tracer.start(every=1000, predicate=lambda msg: msg.chat_id == DEBUG_CHAT)
+        ...
+        tracer.dump("traces.json")
+    """
+    def __init__(self, maxlen: int = 100):
+        self.enabled = False
+        self.every = 0
+        self.predicate = None
+        self.updates = 0
+        self.traces = collections.deque(maxlen=maxlen)
+
+    def start(self, every: int = 100, predicate: Optional[Callable[[Any], bool]] = None, maxlen: Optional[int] = None):
+        """Trace one update of ``every`` (``0`` - none) and the ones matching ``predicate``"""
+        self.every = every
+        self.predicate = predicate
+        if maxlen is not None and maxlen != self.traces.maxlen:
+            self.traces = collections.deque(self.traces, maxlen=maxlen)
+
+        self.enabled = metrics.tracing = metrics.active = True
+
+    def stop(self):
+        self.enabled = metrics.tracing = False
+        metrics.active = metrics.enabled
+
+    def sample(self, update) -> bool:
+        if not self.enabled:
+            return False
+
+        self.updates += 1
+        return (
+            bool(self.every) and self.updates % self.every == 0
+            or self.predicate is not None and bool(self.predicate(update))
+        )
+
+    def add(self, trace: dict):
+        self.traces.append(trace)
+
+    def clear(self):
+        self.traces.clear()
+
+    def dump(self, path: Optional[str] = None) -> str:
+        """Traces as JSON (written to ``path`` if passed)"""
+        data = json.dumps(list(self.traces), ensure_ascii=False, indent=2, default=repr)
+        if path is not None:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(data)
+
+        return data
+
+
+tracer = Tracer()
+"""Sampled traces of all plans (``tracer.start(every=...)``, ``tracer.dump()``)"""
+
+
+@facet("traced")
+def _traced_facet(update) -> bool:
+    """The update is sampled for tracing (decided once, for all plans checking it)"""
+    return tracer.sample(update)
@@ -0,0 +1,139 @@
+import asyncio
+import time
+
+import pytest
+from hikkatl.tl.types import UpdateChannelParticipant
+
+from benchmarks.fakes import FIRST_CHANNEL_ID, MessageFactory, StubClient
+from hikka_filters.cache import AdminIndex, AsyncTTLCache, UsernameIndex
+
+
+def _fetch(calls: list, value, latency: float = 0.01):
+    async def fetch():
+        calls.append(value)
+        await asyncio.sleep(latency)
+        return value
+
+    return fetch
+
+
+def test_concurrent_lookups_are_coalesced():
+    cache = AsyncTTLCache(ttl=60)
+    calls = []
+
+    async def check():
+        assert await asyncio.gather(*(cache.get("key", _fetch(calls, 1)) for _ in range(10))) == [1] * 10
+        assert await cache.get("key", _fetch(calls, 2)) == 1
+
+    asyncio.run(check())
+    assert calls == [1]
+    assert cache.stats() == {"hits": 1, "misses": 1, "coalesced": 9, "size": 1, "maxsize": 10000}
+
+
+def test_cancelled_lookup_does_not_fail_the_others():
+    cache = AsyncTTLCache()
+    calls = []
+
+    async def check():
+        first = asyncio.ensure_future(cache.get("key", _fetch(calls, 1)))
+        second = asyncio.ensure_future(cache.get("key", _fetch(calls, 2)))
+        await asyncio.sleep(0)
+        first.cancel()
+        assert await second == 1
+
+    asyncio.run(check())
+    assert calls == [1]
+
+
+def test_expiry_eviction_and_errors():
+    cache = AsyncTTLCache(ttl=0.05, maxsize=2)
+    calls = []
+
+    async def fail():
+        raise ValueError
+
+    async def check():
+        await cache.get("a", _fetch(calls, "a", 0))
+        await cache.get("b", _fetch(calls, "b", 0))
+        await cache.get("c", _fetch(calls, "c", 0))
+        assert cache.get_cached("a") is None and cache.get_cached("c") == "c"
+        await asyncio.sleep(0.06)
+        assert cache.get_cached("c") is None
+        # errors are not cached
+        with pytest.raises(ValueError):
+            await cache.get("d", fail)
+        assert await cache.get("d", _fetch(calls, "d", 0)) == "d"
+
+    asyncio.run(check())
+    assert calls == ["a", "b", "c", "d"]
+
+
+def test_admin_index():
+    factory = MessageFactory(users=20)
+    client, index = factory.client, AdminIndex(min_refresh_interval=0.05)
+    channel_id = FIRST_CHANNEL_ID + 100
+    admin = next(iter(client.admins))
+
+    async def check():
+        results = await asyncio.gather(*(index.is_admin(client, channel_id, user.id) for user in factory.users))
+        assert {user.id for user, result in zip(factory.users, results) if result} == client.admins
+        assert client.calls["get_participants"] == 1
+
+        # refreshed in the background once stale, checks are answered meanwhile
+        index.notify(UpdateChannelParticipant(channel_id=channel_id, date=None, actor_id=0, user_id=admin, qts=0))
+        assert await index.is_admin(client, channel_id, admin)
+        await asyncio.sleep(0.06)
+        assert await index.is_admin(client, channel_id, admin)
+        await asyncio.sleep(0.01)
+        assert client.calls["get_participants"] == 2
+
+    asyncio.run(check())
+
+
+class NoAdminRights(StubClient):
+    async def get_participants(self, entity, filter=None):
+        await self._request("get_participants")
+        raise PermissionError("CHAT_ADMIN_REQUIRED")
+
+
+def test_admin_index_caches_failures():
+    client, index = NoAdminRights([]), AdminIndex(min_refresh_interval=0.1)
+    channel_id = FIRST_CHANNEL_ID + 101
+
+    async def check():
+        for _ in range(20):
+            assert await index.is_admin(client, channel_id, 1) is False
+
+        assert client.calls["get_participants"] == 1
+        await asyncio.sleep(0.11)
+        assert await index.is_admin(client, channel_id, 1) is False
+        await asyncio.sleep(0.01)
+        assert client.calls["get_participants"] == 2
+
+    asyncio.run(check())
+
+
+def test_username_index(tmp_path):
+    factory = MessageFactory(users=20)
+    client, index = factory.client, UsernameIndex(path=str(tmp_path / "usernames.json"))
+    known = next(user for user in factory.users if user.username)
+
+    async def check():
+        index.resolve(client, [f"@{known.username.upper()}", "nobody_has_it"])
+        # in the background: nothing is known yet
+        assert index.get(known.username) is None
+        started = time.monotonic()
+        while len(index) < 2 and time.monotonic() - started < 1:
+            await asyncio.sleep(0.005)
+
+        assert index.get(known.username) == known.id
+        assert index.get("nobody_has_it") is None
+        index.resolve(client, [known.username, "nobody_has_it"])
+        await asyncio.sleep(0.01)
+        index.stop()
+
+    asyncio.run(check())
+    assert client.calls["get_entity"] == 2
+
+    loaded = UsernameIndex(path=str(tmp_path / "usernames.json"))
+    assert loaded.get(known.username) == known.id and len(loaded) == 2
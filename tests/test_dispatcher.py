@@ -0,0 +1,80 @@
+import asyncio
+import random
+
+import pytest
+
+from benchmarks.fakes import FIRST_CHANNEL_ID, FIRST_CHAT_ID, FIRST_USER_ID, MessageFactory, make_message
+from hikka_filters import Router, chat, chat_type, content_types, media, text, user
+from hikka_filters.filters import CONTENT_TYPES
+
+
+def _indexed_filter(rng: random.Random):
+    roll = rng.randrange(6)
+    if roll == 0:
+        return chat([FIRST_CHANNEL_ID + rng.randrange(20) for _ in range(3)] + [FIRST_CHAT_ID + rng.randrange(10)])
+    if roll == 1:
+        return user([FIRST_USER_ID + rng.randrange(50) for _ in range(10)])
+    if roll == 2:
+        return content_types(rng.sample(CONTENT_TYPES, rng.randint(1, 3)))
+    if roll == 3:
+        return chat_type(rng.sample(["PRIVATE", "CHANNEL", "GROUP", "SUPERGROUP"], rng.randint(1, 2)))
+    if roll == 4:
+        return text(startswith=rng.sample([".", "!", "h", "w", "p"], rng.randint(1, 2)))
+
+    return media
+
+
+def random_filter(rng: random.Random, depth: int = 2):
+    if depth == 0 or rng.random() < 0.3:
+        return _indexed_filter(rng)
+
+    roll = rng.random()
+    if roll < 0.5:
+        return random_filter(rng, depth - 1) & random_filter(rng, depth - 1)
+    if roll < 0.9:
+        return random_filter(rng, depth - 1) | random_filter(rng, depth - 1)
+
+    return ~random_filter(rng, depth - 1)
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_router_calls_all_matching_handlers(seed):
+    rng = random.Random(seed)
+    router = Router()
+    called = []
+    for number in range(30):
+        async def handler(_, message, number=number):
+            called.append(number)
+
+        router.register(handler, random_filter(rng) if number else None)
+
+    async def check():
+        for message in MessageFactory(seed=seed, users=50).pool(200):
+            expected = [
+                number for number, (_, plan) in enumerate(router.handlers) if plan is None or await plan(message)
+            ]
+            called.clear()
+            assert await router.feed(None, message) == len(expected)
+            assert called == expected
+
+    asyncio.run(check())
+
+
+def test_router_content_types_of_one_message():
+    factory = MessageFactory(users=5)
+    router = Router()
+    called = []
+
+    async def handler(_, message):
+        called.append(message)
+
+    router.register(handler, content_types("text") & content_types("photo"))
+    message = make_message(message="caption", media="photo", sender=factory.users[0], client=factory.client)
+    assert asyncio.run(router.feed(None, message)) == 1
+    assert called == [message]
+
+
+def test_router_never_matching_handler_is_kept():
+    router = Router()
+    router.register(lambda _, message: None, chat(1) & chat(2))
+    assert router.candidates(make_message(message="x")) == [0]
@@ -0,0 +1,30 @@
+import asyncio
+
+from hikkatl.tl.types import PeerChannel
+
+from benchmarks.fakes import ME_ID, MessageFactory, make_message
+from hikka_filters import compile_filter, me
+
+
+def test_me():
+    factory = MessageFactory(seed=4)
+    own = next(user for user in factory.users if user.id == ME_ID)
+    channel, group = factory.broadcasts[0], factory.supergroups[0]
+    plan = compile_filter(me)
+
+    async def check():
+        assert await plan(make_message(message="x", peer=PeerChannel(group.id), sender=own, chat=group, out=True))
+        post = make_message(message="x", peer=PeerChannel(channel.id), sender=own, chat=channel, post=True, out=True)
+        assert not await plan(post)
+
+        # sent to a group as the channel (send_as)
+        send_as = make_message(message="x", peer=PeerChannel(group.id), sender=own, chat=group, out=True)
+        send_as.from_id = PeerChannel(channel.id)
+        send_as._sender, send_as._sender_id = channel, -1000000000000 - channel.id
+        assert not await plan(send_as)
+
+        for message in factory.pool(300):
+            expected = message.sender_id is not None and message.sender_id > 0 and message.sender_id == ME_ID
+            assert bool(await plan(message)) == expected
+
+    asyncio.run(check())
@@ -0,0 +1,212 @@
+import asyncio
+import gc
+import inspect
+import random
+import time
+
+import pytest
+
+from hikka_filters.filters import (
+    TIER_ENTITY,
+    TIER_NETWORK,
+    TIER_RAW,
+    AndFilter,
+    ConcurrentFilter,
+    InvertFilter,
+    OrFilter,
+    compile_filter,
+    concurrently,
+    create_filter,
+)
+
+BITS = 8
+
+
+class Update:
+    def __init__(self, bits: int):
+        self.bits = bits
+
+
+def bit_sync(flt, update):
+    return bool(update.bits >> flt.bit & 1)
+
+
+async def bit_async(flt, update):
+    return bool(update.bits >> flt.bit & 1)
+
+
+async def bit_io(flt, update):
+    await asyncio.sleep(0)
+    return bool(update.bits >> flt.bit & 1)
+
+
+def _leaf(rng: random.Random):
+    """Equal leaves are one (interned) filter, so trees share them"""
+    bit = rng.randrange(BITS)
+    kind = rng.randrange(5)
+    if kind == 0:
+        return create_filter(bit_sync, bit=bit, tier=TIER_RAW)
+    if kind == 1:
+        return create_filter(bit_sync, bit=bit, blocking=True)
+    if kind == 2:
+        return create_filter(bit_async, bit=bit, tier=rng.choice((TIER_RAW, TIER_ENTITY)))
+    if kind == 3:
+        return create_filter(bit_io, bit=bit, io_bound=True, cost=0.05, tier=TIER_NETWORK)
+
+    return create_filter(bit_async, bit=bit, side_effects=True)
+
+
+def random_tree(rng: random.Random, depth: int = 4):
+    if depth == 0 or rng.random() < 0.25:
+        return _leaf(rng)
+
+    roll = rng.random()
+    if roll < 0.4:
+        return random_tree(rng, depth - 1) & random_tree(rng, depth - 1)
+    if roll < 0.8:
+        return random_tree(rng, depth - 1) | random_tree(rng, depth - 1)
+    if roll < 0.9:
+        return ~random_tree(rng, depth - 1)
+
+    return concurrently(random_tree(rng, depth - 1) | random_tree(rng, depth - 1))
+
+
+async def naive(flt, update) -> bool:
+    """Recursive evaluation of an expression, as the filters read"""
+    if isinstance(flt, AndFilter):
+        return await naive(flt.base, update) and await naive(flt.other, update)
+    if isinstance(flt, OrFilter):
+        return await naive(flt.base, update) or await naive(flt.other, update)
+    if isinstance(flt, InvertFilter):
+        return not await naive(flt.base, update)
+    if isinstance(flt, ConcurrentFilter):
+        return await naive(flt.base, update)
+
+    result = flt(update)
+    return bool(await result if inspect.isawaitable(result) else result)
+
+
+@pytest.mark.parametrize("adaptive", [False, True])
+@pytest.mark.parametrize("seed", range(20))
+def test_plans_match_naive_evaluation(seed, adaptive):
+    rng = random.Random(seed)
+    trees = [random_tree(rng) for _ in range(6)]
+    plans = [compile_filter(tree, adaptive=adaptive) for tree in trees]
+    for plan in plans:
+        plan.reorder_every = 16
+
+    async def check():
+        for _ in range(64):
+            update = Update(rng.randrange(1 << BITS))
+            for tree, plan in zip(trees, plans):
+                assert bool(await plan(update)) == await naive(tree, update)
+
+    asyncio.run(check())
+
+
+def test_direct_calls_of_combinators():
+    rng = random.Random(100)
+
+    async def check():
+        for _ in range(50):
+            tree = random_tree(rng)
+            update = Update(rng.randrange(1 << BITS))
+            if isinstance(tree, (AndFilter, OrFilter, InvertFilter, ConcurrentFilter)):
+                assert bool(await tree(update)) == await naive(tree, update)
+
+    asyncio.run(check())
+
+
+def test_evaluate_many():
+    rng = random.Random(7)
+    updates = [Update(rng.randrange(1 << BITS)) for _ in range(250)]
+
+    async def check():
+        for _ in range(10):
+            tree = random_tree(rng)
+            assert await tree.evaluate_many(updates, chunk_size=32) == [await naive(tree, update) for update in updates]
+
+    asyncio.run(check())
+
+
+def test_evaluate_many_does_not_recompile_plans():
+    # not used by other tests: not shared yet
+    a = create_filter(bit_async, bit=0, test="evaluate_many")
+    b = create_filter(bit_async, bit=1, test="evaluate_many")
+    plan = compile_filter(a & b)
+    code = plan.code
+    updates = [Update(bits) for bits in range(4)]
+
+    async def check():
+        for flt in (a, b, plan):
+            for _ in range(3):
+                await flt.evaluate_many(updates)
+
+    asyncio.run(check())
+    gc.collect()
+    assert plan.code == code
+
+
+def test_concurrently_memoized_operand():
+    async def hang(flt, update):
+        await asyncio.sleep(10)
+        return True
+
+    async def instant(flt, update):
+        return True
+
+    c = create_filter(hang, io_bound=True)
+    d = create_filter(instant, io_bound=True)
+    # ``c | d`` used by other plans is memoized before it is grouped
+    others = [compile_filter(c | d), compile_filter(create_filter(bit_sync, bit=0) & (c | d))]
+    plan = compile_filter(concurrently(c | d, timeout=0.5))
+
+    async def check():
+        started = time.perf_counter()
+        assert await plan(Update(0)) is True
+        assert time.perf_counter() - started < 0.25
+
+    asyncio.run(check())
+    assert others
+
+
+def test_concurrently_timeout_default():
+    async def hang(flt, update):
+        await asyncio.sleep(10)
+        return True
+
+    plan = compile_filter(
+        concurrently(create_filter(hang, io_bound=True, n=1) & create_filter(hang, io_bound=True, n=2), timeout=0.05, default=True)
+    )
+    assert asyncio.run(plan(Update(0))) is True
+
+
+def test_shared_filters_are_checked_once_per_update():
+    calls = []
+
+    async def counted(flt, update):
+        calls.append(update)
+        return True
+
+    shared = create_filter(counted)
+    plans = [compile_filter(shared & create_filter(bit_sync, bit=bit)) for bit in range(3)]
+    update = Update(0b111)
+
+    async def check():
+        for plan in plans:
+            assert await plan(update)
+
+    asyncio.run(check())
+    assert len(calls) == 1
+
+
+def test_interning():
+    assert create_filter(bit_sync, bit=1) is create_filter(bit_sync, bit=1)
+    assert create_filter(bit_sync, bit=1) is not create_filter(bit_sync, bit=2)
+    assert create_filter(bit_sync, bit=1, _x=1) is not create_filter(bit_sync, bit=1, _x=2)
+    # mutable kwargs, private ones too, are never shared
+    a, b = create_filter(bit_sync, seen=[]), create_filter(bit_sync, seen=[])
+    assert a is not b and a.seen is not b.seen
+    a, b = create_filter(bit_sync, _seen=[]), create_filter(bit_sync, _seen=[])
+    assert a is not b and a._seen is not b._seen
+    assert create_filter(bit_sync, bit=1, dynamic=True) is not create_filter(bit_sync, bit=1, dynamic=True)
@@ -0,0 +1,149 @@
+import asyncio
+import time
+
+import pytest
+from hikkatl.errors import FloodWaitError
+
+from hikka_filters.scheduler import RequestDeferred, RequestScheduler
+
+
+class Requests:
+    """Fetches of one method: counted, ``latency`` long, a flood wait of ``flood`` seconds once"""
+    def __init__(self, latency: float = 0.0, flood: int = 0):
+        self.latency = latency
+        self.flood = flood
+        self.calls = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def __call__(self, result):
+        async def fetch():
+            self.calls += 1
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                await asyncio.sleep(self.latency)
+                if self.flood:
+                    seconds, self.flood = self.flood, 0
+                    raise FloodWaitError(request=None, capture=seconds)
+            finally:
+                self.in_flight -= 1
+
+            return result
+
+        return fetch
+
+
+def test_identical_requests_are_made_once():
+    scheduler = RequestScheduler()
+    requests = Requests(latency=0.01)
+
+    async def check():
+        results = await asyncio.gather(*(scheduler.call("get_fulluser", 1, requests("bio")) for _ in range(5)))
+        assert results == ["bio"] * 5
+        assert await scheduler.call("get_fulluser", 2, requests("other")) == "other"
+
+    asyncio.run(check())
+    assert requests.calls == 2
+    assert scheduler.stats()["deduplicated"] == 4
+    assert scheduler.stats()["pending"] == 0
+
+
+@pytest.mark.parametrize("fallback", ["closed", "open"])
+def test_backoff_defers_requests(fallback):
+    scheduler = RequestScheduler(fallback=fallback)
+    requests = Requests(flood=30)
+
+    async def check():
+        with pytest.raises(RequestDeferred) as e:
+            await scheduler.call("get_permissions", 1, requests(True))
+
+        assert e.value.method == "get_permissions" and e.value.seconds == 30
+        with pytest.raises(RequestDeferred):
+            await scheduler.call("get_permissions", 2, requests(True))
+
+        # other methods are not blocked
+        assert await scheduler.call("get_fulluser", 1, requests("bio")) == "bio"
+
+    asyncio.run(check())
+    assert requests.calls == 2
+    assert 29 < scheduler.backoff("get_permissions") <= 30
+    assert scheduler.backoff("get_fulluser") == 0
+    assert scheduler.fails_open("get_permissions") is (fallback == "open")
+    assert scheduler.stats()["flood_waits"] == 1
+
+    scheduler.clear()
+    assert scheduler.backoff("get_permissions") == 0
+
+
+def test_cache_fallback_answers_last_result():
+    scheduler = RequestScheduler(fallback="closed", method_fallback={"get_permissions": "cache"})
+    requests = Requests()
+
+    async def check():
+        assert await scheduler.call("get_permissions", 1, requests("admin")) == "admin"
+        requests.flood = 10
+        # the flood wait is answered by the last result of the same request
+        assert await scheduler.call("get_permissions", 1, requests("new")) == "admin"
+        assert await scheduler.call("get_permissions", 1, requests("new")) == "admin"
+        # no result to fall back to
+        with pytest.raises(RequestDeferred):
+            await scheduler.call("get_permissions", 2, requests("new"))
+
+    asyncio.run(check())
+    assert requests.calls == 2
+    assert scheduler.stats()["deferred"] == 3
+
+
+def test_concurrency_limits():
+    scheduler = RequestScheduler(concurrency=3, method_concurrency={"get_participants": 1})
+    participants, users = Requests(latency=0.01), Requests(latency=0.01)
+
+    async def check():
+        await asyncio.gather(
+            *(scheduler.call("get_participants", key, participants(key)) for key in range(4)),
+            *(scheduler.call("get_fulluser", key, users(key)) for key in range(8)),
+        )
+
+    asyncio.run(check())
+    assert participants.max_in_flight == 1
+    assert users.max_in_flight <= 3
+
+
+def test_method_queue_does_not_hold_global_slots():
+    scheduler = RequestScheduler(concurrency=2, method_concurrency={"get_fulluser": 1})
+    slow, fast = Requests(latency=0.1), Requests()
+
+    async def check():
+        queued = [asyncio.ensure_future(scheduler.call("get_fulluser", key, slow(key))) for key in range(4)]
+        await asyncio.sleep(0)
+        started = time.perf_counter()
+        assert await scheduler.call("get_permissions", 1, fast(True)) is True
+        assert time.perf_counter() - started < 0.05
+        await asyncio.gather(*queued)
+
+    asyncio.run(check())
+
+
+def test_rate():
+    scheduler = RequestScheduler(rate=50, burst=2)
+    requests = Requests()
+
+    async def check():
+        started = time.perf_counter()
+        await asyncio.gather(*(scheduler.call("get_entity", key, requests(key)) for key in range(6)))
+        # 2 at once, then 4 more at 50 per second
+        assert time.perf_counter() - started >= 0.07
+
+    asyncio.run(check())
+    assert requests.calls == 6
+
+
+def test_configure():
+    scheduler = RequestScheduler()
+    scheduler.configure(concurrency=2, fallback="open")
+    assert scheduler.concurrency == 2 and scheduler.fails_open("get_permissions")
+    with pytest.raises(TypeError):
+        scheduler.configure(_blocked={})
+    with pytest.raises(ValueError):
+        scheduler.configure(fallback="sometimes")
@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+from benchmarks.fakes import MessageFactory
+from hikka_filters import compile_filter, throttle
+from hikka_filters.throttle import SketchBuckets, TokenBuckets
+
+
+@pytest.mark.parametrize("buckets", [TokenBuckets(1, 3, maxkeys=16), SketchBuckets(1, 3, width=1024)])
+def test_burst_then_rate(buckets):
+    assert [buckets.take("a", 0.0) for _ in range(4)] == [True, True, True, False]
+    assert buckets.take("b", 0.0)
+    assert buckets.take("a", 1.0)
+    assert not buckets.take("a", 1.0)
+    assert buckets.take("a", 10.0)
+
+
+@pytest.mark.parametrize("make", [lambda: TokenBuckets(0.2, 1), lambda: SketchBuckets(0.2, 1, width=64)])
+def test_rate_below_one_per_second(make):
+    buckets = make()
+    assert buckets.take("a", 0.0)
+    assert not buckets.take("a", 1.0)
+    assert buckets.take("a", 5.0)
+
+
+def test_lru_evicts_to_maxkeys():
+    buckets = TokenBuckets(1, 1, maxkeys=4)
+    for key in range(10):
+        assert buckets.take(key, 0.0)
+
+    assert len(buckets) == 4
+    assert buckets.evictions == 6
+
+
+@pytest.mark.parametrize("make", [lambda: TokenBuckets(1, 0.5), lambda: SketchBuckets(1, 0.5), lambda: throttle(1, 0.5)])
+def test_burst_below_one_is_rejected(make):
+    with pytest.raises(ValueError):
+        make()
+
+
+def test_default_burst():
+    assert throttle(0.2).burst == 1
+    assert throttle(5).burst == 5
+
+
+def test_throttles_share_buckets_only_by_name():
+    assert throttle(1, 5) is not throttle(1, 5)
+    assert throttle(1, 5, name="a") is throttle(1, 5, name="a")
+    assert throttle(1, 5, name="a") is not throttle(1, 5, name="b")
+
+
+@pytest.mark.parametrize("mode", ["lru", "sketch"])
+def test_one_token_per_update(mode):
+    flt = throttle(1, 1, mode=mode)
+    plans = [compile_filter(flt), compile_filter(flt)]
+    messages = [message for message in MessageFactory(users=5).pool(50) if message.sender_id is not None]
+
+    async def check():
+        passed = []
+        for message in messages:
+            results = [bool(await plan(message)) for plan in plans]
+            # all handlers of an update get the same answer
+            assert results[0] == results[1]
+            passed.append(results[0])
+
+        # one token per sender in the burst, none refilled in this short run
+        assert sum(passed) == len({message.sender_id for message in messages})
+
+    asyncio.run(check())